@@ -0,0 +1,93 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.urls import URLPattern, URLResolver
+from rest_framework.permissions import SAFE_METHODS
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ASYNC_READ_WORKERS,
+                thread_name_prefix='async-read'
+            )
+        return _executor
+
+
+def _render_view(view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+def _run_view(view, request, *args, **kwargs):
+    close_old_connections()
+    try:
+        return _render_view(view, request, *args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def async_view(view):
+    """Асинхронная обёртка синхронной DRF-вьюхи для ASGI.
+
+    В Django 3.2 нет асинхронного ORM, поэтому запрос целиком,
+    вместе с рендерингом, выполняется в потоке. Обычный sync_to_async
+    ставит все синхронные вьюхи в один поток, а здесь безопасные
+    запросы идут параллельно в пуле, не занимая цикл событий. Запись
+    остаётся в общем потоке, как у Django для синхронных вьюх.
+    """
+    write = sync_to_async(_render_view, thread_sensitive=True)
+
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in SAFE_METHODS:
+            return await write(view, request, *args, **kwargs)
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            get_executor(),
+            functools.partial(
+                context.run, _run_view, view, request, *args, **kwargs)
+        )
+
+    wrapper.csrf_exempt = getattr(view, 'csrf_exempt', False)
+    # Для middleware, которые смотрят на класс представления и действие
+    for name in ('cls', 'view_class', 'actions', 'initkwargs'):
+        if hasattr(view, name):
+            setattr(wrapper, name, getattr(view, name))
+    return wrapper
+
+
+def async_patterns(patterns):
+    """Копия маршрутов с представлениями, обёрнутыми в async_view;
+    под ASGI ими заменяются маршруты API (см. urls.py)"""
+    result = []
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            result.append(URLResolver(
+                pattern.pattern,
+                async_patterns(pattern.url_patterns),
+                pattern.default_kwargs,
+                pattern.app_name,
+                pattern.namespace,
+            ))
+        else:
+            result.append(URLPattern(
+                pattern.pattern,
+                async_view(pattern.callback),
+                pattern.default_args,
+                pattern.name,
+            ))
+    return result
@@ -0,0 +1,168 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+# Не кэшируются: хэш пароля не должен попадать в общий кэш, счётчики
+# и флаг подписки меняются помимо самого пользователя, а last_login —
+# при каждом входе. При обращении догружаются из БД
+UNCACHED_USER_FIELDS = (
+    'password', 'last_login', 'recipes_count', 'followers_count',
+    'is_subscribed'
+)
+
+
+class LRUCache:
+    """Ограниченный по размеру кэш в памяти процесса со временем жизни
+    записей; вытесняются давно не использованные"""
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.data = OrderedDict()
+        # Растёт при каждом удалении, см. set()
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value, generation=None):
+        """С generation запись не сохраняется, если после чтения
+        generation что-то удалялось: значение могло быть прочитано
+        из БД до отзыва"""
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.data[key] = (time.monotonic() + self.timeout, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+            self.generation += 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.generation += 1
+
+
+token_cache = LRUCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TIMEOUT)
+
+
+def cache_key(key):
+    return 'auth-token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def revocation_key(name):
+    return 'revoked:' + name
+
+
+def revocation_timeout():
+    """Сколько хранится отметка об отзыве: дольше любой записи,
+    снятой до отзыва, с запасом на копию общей записи в LRU"""
+    return 2 * settings.TOKEN_CACHE_TIMEOUT
+
+
+def user_fields():
+    return [
+        field.attname for field in get_user_model()._meta.concrete_fields
+        if field.attname not in UNCACHED_USER_FIELDS
+    ]
+
+
+def dump_token(token):
+    user = token.user
+    return (
+        token._state.db,
+        token.created,
+        tuple(getattr(user, name) for name in user_fields()),
+    )
+
+
+def load_token(model, key, entry):
+    """Токен с пользователем из записи кэша, каждый раз новые объекты:
+    запросы не делят между собой один экземпляр"""
+    db, created, values = entry
+    user = get_user_model().from_db(db, user_fields(), values)
+    token = model(key=key, user=user, created=created)
+    token._state.adding = False
+    token._state.db = db
+    return token
+
+
+def revoke_token(key):
+    """Сбрасывает токен во всех уровнях кэша. Новая отметка об отзыве
+    заставляет другие процессы не доверять своим локальным копиям
+    этого токена, записи остальных токенов остаются"""
+    name = cache_key(key)
+    token_cache.delete(name)
+    if settings.TOKEN_CACHE_SHARED:
+        cache.delete(name)
+        cache.set(
+            revocation_key(name), uuid.uuid4().hex, revocation_timeout())
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к БД на каждый запрос.
+
+    Пара токен–пользователь хранится в LRU процесса
+    (TOKEN_CACHE_SIZE записей на TOKEN_CACHE_TIMEOUT секунд) и, при
+    TOKEN_CACHE_SHARED, в общем кэше. Тогда на запрос уходит один
+    get_many() к кэшу: вместе с записью читается отметка об отзыве
+    этого токена, и локальные копии, снятые до его отзыва в другом
+    процессе, не используются. Без общего кэша отзыв в другом
+    процессе виден через TOKEN_CACHE_TIMEOUT. Сбрасывается сигналами
+    удаления токена и сохранения пользователя.
+    """
+
+    def authenticate_credentials(self, key):
+        model = self.get_model()
+        name = cache_key(key)
+        # Отметка читается до запроса к БД: запись, снятая до отзыва,
+        # окажется со старой отметкой и не будет принята
+        generation = token_cache.generation
+        if settings.TOKEN_CACHE_SHARED:
+            cached = cache.get_many((revocation_key(name), name))
+            revoked = cached.get(revocation_key(name))
+            shared = cached.get(name)
+        else:
+            revoked, shared = None, None
+        for item in (token_cache.get(name), shared):
+            if item is not None and item[0] == revoked:
+                if item is shared:
+                    token_cache.set(name, item, generation)
+                return self.credentials(model, key, item[1])
+        user, token = super().authenticate_credentials(key)
+        item = (revoked, dump_token(token))
+        token_cache.set(name, item, generation)
+        if settings.TOKEN_CACHE_SHARED:
+            cache.set(name, item, settings.TOKEN_CACHE_TIMEOUT)
+        return user, token
+
+    def credentials(self, model, key, entry):
+        token = load_token(model, key, entry)
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        return token.user, token
@@ -0,0 +1,90 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def version_key(name):
+    return f'reference:{name}:version'
+
+
+def get_version(name):
+    """Текущая версия справочника, меняется при любом его изменении"""
+    key = version_key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_version(name):
+    key = version_key(name)
+    cache.add(key, 1, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def cached_reference(name, label, factory):
+    """Данные, построенные по справочнику; пересчитываются только
+    после смены его версии"""
+    key = 'reference:{}:{}:{}'.format(name, get_version(name), label)
+    return cache.get_or_set(key, factory, settings.REFERENCE_CACHE_TIMEOUT)
+
+
+def make_etag(data):
+    payload = json.dumps(data, ensure_ascii=False, sort_keys=True)
+    return '"{}"'.format(hashlib.sha1(payload.encode()).hexdigest())
+
+
+class ReferenceCacheMixin:
+    """Кэширует ответы list/retrieve справочника под ключом версии
+    и отвечает 304 на If-None-Match с тем же ETag"""
+    reference_name = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, super().retrieve, *args, **kwargs)
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        key = 'reference:{}:{}:{}'.format(
+            self.reference_name,
+            get_version(self.reference_name),
+            request.get_full_path()
+        )
+        cached = cache.get(key)
+        if cached is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cached = (response.data, make_etag(response.data))
+            cache.set(key, cached, settings.REFERENCE_CACHE_TIMEOUT)
+        return self.conditional_response(request, *cached)
+
+    def conditional_response(self, request, data, etag=None):
+        etag = etag or make_etag(data)
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        patch_cache_control(
+            response,
+            public=True,
+            max_age=settings.REFERENCE_CACHE_MAX_AGE,
+            must_revalidate=True
+        )
+        patch_vary_headers(response, ('Accept',))
+        return response
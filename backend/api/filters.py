@@ -1,16 +1,36 @@
+from django.db.models import Exists, OuterRef
 from django_filters import NumberFilter
-from django_filters.rest_framework import (BooleanFilter, FilterSet,
-                                           ModelMultipleChoiceFilter)
-from recipes.models import Ingredient, Tag
-from rest_framework.filters import SearchFilter
+from django_filters.rest_framework import (BooleanFilter, CharFilter,
+                                           FilterSet, MultipleChoiceFilter)
+from recipes.models import Favorite, Ingredient, ShoppingCart, Tag, TagRecipe
+from recipes.search import is_ranked, search_recipes
+from rest_framework.filters import OrderingFilter, SearchFilter
+
+from .cache import cached_reference
+
+
+def tag_ids_by_slug():
+    """Словарь slug -> id тегов, кэшируется до изменения тегов"""
+    return cached_reference(
+        'tags', 'ids-by-slug',
+        lambda: dict(Tag.objects.values_list('slug', 'id'))
+    )
+
+
+def tag_choices():
+    return [(slug, slug) for slug in tag_ids_by_slug()]
 
 
 class RecipeFilter(FilterSet):
-    """Класс для фильтрации рецептов"""
-    tags = ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all()
+    """Класс для фильтрации рецептов.
+
+    Все фильтры — полусоединения (id IN (...) и EXISTS), поэтому рецепт
+    с несколькими подходящими тегами попадает в выдачу один раз
+    и distinct() не нужен.
+    """
+    tags = MultipleChoiceFilter(
+        choices=tag_choices,
+        method='get_tags'
     )
     author = NumberFilter(field_name='author__id')
 
@@ -18,16 +38,50 @@ class RecipeFilter(FilterSet):
         method='get_is_favorited')
     is_in_shopping_cart = BooleanFilter(
         method='get_is_in_shopping_cart')
+    search = CharFilter(method='get_search')
+
+    def get_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        ids_by_slug = tag_ids_by_slug()
+        return queryset.filter(pk__in=TagRecipe.objects.filter(
+            tag_id__in=[ids_by_slug[slug] for slug in value]
+        ).values('recipe_id'))
+
+    def filter_user_link(self, queryset, model, value):
+        user = self.request.user
+        if value is None or not user.is_authenticated:
+            return queryset
+        linked = Exists(model.objects.filter(user=user, recipe=OuterRef('pk')))
+        return queryset.filter(linked if value else ~linked)
 
     def get_is_favorited(self, queryset, name, value):
-        if self.request.user.is_authenticated:
-            return queryset.filter(recipe_favorite__user=self.request.user)
-        return queryset
+        return self.filter_user_link(queryset, Favorite, value)
 
     def get_is_in_shopping_cart(self, queryset, name, value):
-        if self.request.user.is_authenticated:
-            return queryset.filter(recipe_in_cart__user=self.request.user)
-        return queryset
+        return self.filter_user_link(queryset, ShoppingCart, value)
+
+    def get_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    """Без явного ordering результаты поиска идут по релевантности.
+    Равные значения сортировки упорядочиваются по -id: иначе страницы
+    повторяли бы или пропускали рецепты"""
+    unique_fields = ('id', '-id', 'pk', '-pk')
+
+    def get_ordering(self, request, queryset, view):
+        if (
+            self.ordering_param not in request.query_params
+            and is_ranked(queryset)
+        ):
+            return ('-search_rank', '-id')
+        ordering = tuple(
+            super().get_ordering(request, queryset, view) or ())
+        if not set(ordering) & set(self.unique_fields):
+            ordering += ('-id',)
+        return ordering
 
 
 class IngredientFilter(SearchFilter):
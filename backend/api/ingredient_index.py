@@ -0,0 +1,53 @@
+import bisect
+import threading
+
+from recipes.models import Ingredient
+
+from .cache import get_version
+
+
+class IngredientIndex:
+    """Отсортированный индекс ингредиентов в памяти процесса.
+
+    Отвечает на поиск по началу названия без обращения к БД.
+    Строится при первом запросе и перестраивается, когда сигналы модели
+    меняют версию справочника ingredients в кэше.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def _get_snapshot(self):
+        version = get_version('ingredients')
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot[0] == version:
+            return snapshot[1:]
+        with self._lock:
+            if self._snapshot is None or self._snapshot[0] != version:
+                items = sorted(
+                    Ingredient.objects.values(
+                        'id', 'name', 'measurement_unit'),
+                    key=lambda item: (item['name'].lower(), item['id'])
+                )
+                keys = [item['name'].lower() for item in items]
+                self._snapshot = (version, keys, items)
+            return self._snapshot[1:]
+
+    def search(self, query):
+        """Ингредиенты, название которых начинается с query,
+        а за ними те, где query встречается внутри названия"""
+        keys, items = self._get_snapshot()
+        query = query.lower()
+        start = bisect.bisect_left(keys, query)
+        end = start
+        while end < len(keys) and keys[end].startswith(query):
+            end += 1
+        substring_matches = [
+            item for key, item in zip(keys, items)
+            if query in key and not key.startswith(query)
+        ]
+        return items[start:end] + substring_matches
+
+
+ingredient_index = IngredientIndex()
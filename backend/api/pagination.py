@@ -1,5 +1,113 @@
-from rest_framework.pagination import PageNumberPagination
+from collections import OrderedDict
+
+from recipes.models import FeedEntry
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, CursorPagination,
+                                       PageNumberPagination)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+PAGE_SIZE = 6
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Постраничный вывод по ключу -id: без OFFSET и COUNT(*)"""
+    page_size = PAGE_SIZE
+    ordering = '-id'
+
+    def get_ordering(self, request, queryset, view):
+        """Курсор всегда по -id, даже при сортировке или поиске"""
+        return (self.ordering,)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', None),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
 
 
 class RecipePagination(PageNumberPagination):
-    page_size = 6
+    """Постраничный вывод по номеру страницы.
+
+    Если в запросе есть параметр cursor (хотя бы пустой), выдача идёт
+    курсором: глубокие страницы стоят столько же, сколько первая,
+    а count не считается и равен null.
+    """
+    page_size = PAGE_SIZE
+    cursor_query_param = 'cursor'
+    cursor_pagination_class = RecipeCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.cursor_query_param in request.query_params:
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class FeedPagination(BasePagination):
+    """Лента по ключу: страница — рецепты с id меньше before,
+    следующая начинается после последнего рецепта страницы"""
+    page_size = PAGE_SIZE
+    max_page_size = 100
+    before_query_param = 'before'
+    limit_query_param = 'limit'
+
+    def paginate_feed(self, user, request):
+        """id рецептов страницы ленты пользователя"""
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.recipe_ids = FeedEntry.recipe_ids(
+            user, self.limit, self.get_before(request))
+        return self.recipe_ids
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(limit, 1), self.max_page_size)
+
+    def get_before(self, request):
+        before = request.query_params.get(self.before_query_param)
+        if before is None:
+            return None
+        try:
+            return int(before)
+        except ValueError:
+            raise NotFound('Неверное значение before')
+
+    def get_next_link(self):
+        if len(self.recipe_ids) < self.limit:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.before_query_param,
+            self.recipe_ids[-1]
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', None),
+            ('next', self.get_next_link()),
+            ('previous', None),
+            ('results', data),
+        ]))
+
+
+def get_recipes_limit(request):
+    """Значение параметра recipes_limit или None"""
+    try:
+        recipes_limit = int(request.query_params.get('recipes_limit'))
+    except (TypeError, ValueError):
+        return None
+    return recipes_limit if recipes_limit > 0 else None
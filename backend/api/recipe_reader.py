@@ -0,0 +1,92 @@
+from collections import defaultdict
+
+from recipes.models import IngredientRecipe, Recipe, Subscribe, TagRecipe
+from recipes.renditions import rendition_urls
+from users.models import CustomUser
+
+RECIPE_FIELDS = (
+    'id', 'author_id', 'name', 'image', 'text', 'cooking_time',
+    'renditions_ready', 'is_favorited', 'is_in_shopping_cart',
+)
+AUTHOR_FIELDS = (
+    'email', 'id', 'username', 'first_name', 'last_name', 'subscribed',
+)
+image_storage = Recipe._meta.get_field('image').storage
+
+
+def recipe_rows(queryset):
+    """Строки рецептов для read_recipes; queryset — with_user_flags()"""
+    return queryset.values(*RECIPE_FIELDS)
+
+
+def absolute_rendition_urls(image_name, ready, request):
+    urls = rendition_urls(image_name, ready)
+    if request is None:
+        return urls
+    return {
+        rendition: request.build_absolute_uri(url)
+        for rendition, url in urls.items()
+    }
+
+
+def read_recipes(rows, request):
+    """Словари рецептов в точности как у RecipeReadSerializer.
+
+    Авторы, теги и ингредиенты страницы читаются тремя запросами
+    через values(), без создания моделей и полей сериализатора.
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+    ids = [row['id'] for row in rows]
+    authors = {
+        author['id']: author
+        for author in Subscribe.annotate_subscribed(
+            CustomUser.objects.filter(
+                pk__in={row['author_id'] for row in rows}),
+            request.user
+        ).values(*AUTHOR_FIELDS)
+    }
+    tags = defaultdict(list)
+    for recipe_id, *tag in TagRecipe.objects.filter(
+        recipe_id__in=ids
+    ).order_by('tag_id').values_list(
+        'recipe_id', 'tag_id', 'tag__name', 'tag__slug', 'tag__color'
+    ):
+        tags[recipe_id].append(dict(zip(('id', 'name', 'slug', 'color'), tag)))
+    ingredients = defaultdict(list)
+    for recipe_id, *ingredient in IngredientRecipe.objects.filter(
+        recipe_id__in=ids
+    ).order_by('id').values_list(
+        'recipe_id', 'ingredient_id', 'ingredient__name',
+        'ingredient__measurement_unit', 'amount'
+    ):
+        ingredients[recipe_id].append(dict(zip(
+            ('id', 'name', 'measurement_unit', 'amount'), ingredient)))
+    recipes = []
+    for row in rows:
+        author = authors[row['author_id']]
+        image = row['image']
+        recipes.append({
+            'id': row['id'],
+            'author': {
+                'email': author['email'],
+                'id': author['id'],
+                'username': author['username'],
+                'first_name': author['first_name'],
+                'last_name': author['last_name'],
+                'is_subscribed': author['subscribed'],
+            },
+            'name': row['name'],
+            'image': request.build_absolute_uri(
+                image_storage.url(image)) if image else None,
+            'image_renditions': absolute_rendition_urls(
+                image, row['renditions_ready'], request) if image else None,
+            'text': row['text'],
+            'ingredients': ingredients[row['id']],
+            'tags': tags[row['id']],
+            'cooking_time': row['cooking_time'],
+            'is_favorited': row['is_favorited'],
+            'is_in_shopping_cart': row['is_in_shopping_cart'],
+        })
+    return recipes
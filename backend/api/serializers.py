@@ -1,25 +1,74 @@
 import base64
-
-from django.core.files.base import ContentFile
-from django.db import transaction
+import binascii
+import re
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.files import File
+from django.db import IntegrityError, transaction
 from djoser.serializers import UserSerializer
+from PIL import ImageFile
 from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                            ShoppingCart, Subscribe, Tag)
+                            ShoppingCart, ShoppingListItem, Subscribe, Tag,
+                            TagRecipe)
 from rest_framework import serializers
 from rest_framework.relations import PrimaryKeyRelatedField, SlugRelatedField
 from users.models import CustomUser
 
+from .recipe_reader import absolute_rendition_urls
+
 
 class Base64ImageField(serializers.ImageField):
-    """Кастомный тип поля для image field в модели Recipe"""
+    """Кастомный тип поля для image field в модели Recipe.
+
+    Декодирует base64 по частям, проверяя размер файла и изображения
+    до полной распаковки. Имя по хэшу содержимого даёт хранилище.
+    """
+    chunk_size = 64 * 1024
+    # b64decode пропускает символы не из алфавита (переносы строк
+    # в base64 по MIME); их убирают заранее, чтобы части делились
+    # по группам из четырёх символов
+    ignored_characters = re.compile(r'[^A-Za-z0-9+/=]+')
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            data = self.decode(imgstr, ext)
 
         return super().to_internal_value(data)
 
+    def decode(self, imgstr, ext):
+        imgstr = self.ignored_characters.sub('', imgstr)
+        if len(imgstr) * 3 // 4 > settings.IMAGE_MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError(
+                'Размер изображения превышает допустимый'
+            )
+        buffer = SpooledTemporaryFile(max_size=self.chunk_size * 16)
+        parser = ImageFile.Parser()
+        for start in range(0, len(imgstr), self.chunk_size):
+            try:
+                chunk = base64.b64decode(
+                    imgstr[start:start + self.chunk_size])
+            except (binascii.Error, ValueError):
+                raise serializers.ValidationError(
+                    'Некорректные данные изображения'
+                )
+            if parser is not None:
+                parser.feed(chunk)
+                if parser.image is not None:
+                    if max(parser.image.size) > (
+                        settings.IMAGE_MAX_DIMENSION
+                    ):
+                        raise serializers.ValidationError(
+                            'Разрешение изображения превышает допустимое'
+                        )
+                    parser = None
+            buffer.write(chunk)
+        buffer.seek(0)
+        return File(buffer, name=f'image.{ext}')
+
 
 class CustomUserSerializer(UserSerializer):
     """Сериализатор для модели CustomUser"""
@@ -37,6 +86,9 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        subscribed = getattr(obj, 'subscribed', None)
+        if subscribed is not None:
+            return subscribed
         try:
             request = self.context.get('request')
             user = request.user
@@ -121,6 +173,7 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         many=True,
         read_only=True
     )
+    image_renditions = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -130,6 +183,7 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             'author',
             'name',
             'image',
+            'image_renditions',
             'text',
             'ingredients',
             'tags',
@@ -139,7 +193,16 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         )
         model = Recipe
 
+    def get_image_renditions(self, obj):
+        if not obj.image:
+            return None
+        return absolute_rendition_urls(
+            obj.image.name, obj.renditions_ready, self.context.get('request'))
+
     def get_is_favorited(self, obj):
+        is_favorited = getattr(obj, 'is_favorited', None)
+        if is_favorited is not None:
+            return is_favorited
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             user = request.user
@@ -147,6 +210,9 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        is_in_shopping_cart = getattr(obj, 'is_in_shopping_cart', None)
+        if is_in_shopping_cart is not None:
+            return is_in_shopping_cart
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             user = request.user
@@ -183,81 +249,129 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         )
         model = Recipe
 
+    def validate_ingredients(self, value):
+        ingredient_ids = [ingredient['id'] for ingredient in value]
+        if len(ingredient_ids) != len(set(ingredient_ids)):
+            raise serializers.ValidationError(
+                'Ингредиенты не должны повторяться'
+            )
+        existing = set(Ingredient.objects.filter(
+            pk__in=ingredient_ids
+        ).values_list('pk', flat=True))
+        missing = [pk for pk in ingredient_ids if pk not in existing]
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {missing}'
+            )
+        return value
+
     def ingredients_for_recipe(self, recipe, ingredients):
-        recipe_ingredient_list = []
-        for ingredient in ingredients:
-            current_ingredient = Ingredient.objects.get(
-                pk=ingredient['id'])
-            recipe_ingredient = IngredientRecipe(
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
                 recipe=recipe,
-                ingredient=current_ingredient,
-                amount=ingredient['amount'])
-            recipe_ingredient_list.append(recipe_ingredient)
-        IngredientRecipe.objects.bulk_create(recipe_ingredient_list)
+                ingredient_id=ingredient['id'],
+                amount=ingredient['amount']
+            )
+            for ingredient in ingredients
+        )
+
+    def tags_for_recipe(self, recipe, tags):
+        TagRecipe.objects.bulk_create(
+            TagRecipe(recipe=recipe, tag=tag) for tag in tags
+        )
+
+    def update_ingredients(self, recipe, ingredients):
+        """Меняет только отличающиеся строки IngredientRecipe"""
+        current = {
+            row.ingredient_id: row
+            for row in recipe.ingredientrecipe_set.all()
+        }
+        amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        deltas = {
+            ingredient_id: amount - (
+                current[ingredient_id].amount if ingredient_id in current
+                else 0
+            )
+            for ingredient_id, amount in amounts.items()
+        }
+        to_update = []
+        for ingredient_id, amount in amounts.items():
+            row = current.get(ingredient_id)
+            if row is not None and row.amount != amount:
+                row.amount = amount
+                to_update.append(row)
+        to_delete = []
+        for ingredient_id, row in current.items():
+            if ingredient_id not in amounts:
+                to_delete.append(row.pk)
+                deltas[ingredient_id] = -row.amount
+        if to_delete:
+            IngredientRecipe.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            IngredientRecipe.objects.bulk_update(to_update, ['amount'])
+        self.ingredients_for_recipe(recipe, [
+            ingredient for ingredient in ingredients
+            if ingredient['id'] not in current
+        ])
+        ShoppingListItem.recipe_changed(recipe, deltas)
+
+    def update_tags(self, recipe, tags):
+        """Удаляет и добавляет только изменившиеся теги"""
+        current = set(TagRecipe.objects.filter(
+            recipe=recipe
+        ).values_list('tag_id', flat=True))
+        wanted = {tag.pk for tag in tags}
+        if current - wanted:
+            TagRecipe.objects.filter(
+                recipe=recipe, tag_id__in=current - wanted
+            ).delete()
+        self.tags_for_recipe(
+            recipe, [tag for tag in set(tags) if tag.pk not in current])
 
     @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
-        recipe.tags.add(*tags)
+        self.tags_for_recipe(recipe, set(tags))
         self.ingredients_for_recipe(recipe, ingredients)
         return recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
         instance.name = validated_data.get('name', instance.name)
-        instance.image = validated_data.get('image', instance.image)
+        update_fields = ['name', 'text', 'cooking_time']
+        if 'image' in validated_data:
+            # Файл сохраняется сразу: имя по хэшу показывает, сменилось
+            # ли изображение. Копии нового отметит make_renditions
+            previous = instance.image.name
+            image = validated_data['image']
+            instance.image.save(image.name, image, save=False)
+            if instance.image.name != previous:
+                instance.renditions_ready = False
+                update_fields += ['image', 'renditions_ready']
         instance.text = validated_data.get('text', instance.text)
         instance.cooking_time = validated_data.get(
             'cooking_time',
             instance.cooking_time
         )
-        tags_data = validated_data.pop('tags')
-        ingredients_data = validated_data.pop('ingredients')
-        instance.tags.clear()
-        instance.ingredients.clear()
-        instance.tags.set(tags_data)
-        self.ingredients_for_recipe(instance, ingredients_data)
-        instance.save()
+        tags_data = validated_data.pop('tags', None)
+        ingredients_data = validated_data.pop('ingredients', None)
+        if tags_data is not None:
+            self.update_tags(instance, tags_data)
+        if ingredients_data is not None:
+            self.update_ingredients(instance, ingredients_data)
+        instance.save(update_fields=update_fields)
         return instance
 
-    def validate_favorite(self, user, recipe):
-        is_added = Favorite.objects.filter(
-            user=user, recipe=recipe).exists()
-
-        if is_added:
-            raise serializers.ValidationError(
-                {'detail': 'Рецепт уже добавлен в избранное'}
-            )
-
-    def validate_not_favorite(self, user, recipe):
-        favorite = Favorite.objects.filter(user=user, recipe=recipe)
-        if not favorite:
-            raise serializers.ValidationError(
-                {'detail': 'Рецепт не добавлен в избранное'}
-            )
-        return favorite
-
-    def validate_shopping_cart(self, user, recipe):
-        is_added = ShoppingCart.objects.filter(
-            user=user, recipe=recipe).exists()
-        if is_added:
-            raise serializers.ValidationError(
-                {'detail': 'Рецепт уже в списке покупок'}
-            )
-
-    def validate_not_shopping_cart(self, user, recipe):
-        shopping_cart_item = ShoppingCart.objects.filter(
-            recipe=recipe, user=user)
-        if not shopping_cart_item:
-            raise serializers.ValidationError(
-                {'detail': 'Рецепт не в списке покупок'}
-            )
-        return shopping_cart_item
-
     def to_representation(self, instance):
-        serializer = RecipeReadSerializer(instance)
+        request = self.context.get('request')
+        user = request.user if request else AnonymousUser()
+        instance = Recipe.objects.for_read(user).get(pk=instance.pk)
+        serializer = RecipeReadSerializer(instance, context=self.context)
         return serializer.data
 
 
@@ -275,6 +389,19 @@ class SubscribeRecipeSerializer(serializers.ModelSerializer):
         model = Recipe
 
 
+class RecipeBatchSerializer(serializers.Serializer):
+    """Список id рецептов для пакетного изменения избранного
+    и списка покупок"""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.RECIPE_BATCH_MAX_SIZE,
+    )
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
+
 class SubscribeSerializer(serializers.ModelSerializer):
     """Сериализатор для модели Subscribe"""
     email = serializers.EmailField(read_only=True)
@@ -282,7 +409,6 @@ class SubscribeSerializer(serializers.ModelSerializer):
     first_name = serializers.CharField(read_only=True)
     last_name = serializers.CharField(read_only=True)
     recipes = SubscribeRecipeSerializer(many=True, read_only=True)
-    recipes_count = serializers.SerializerMethodField()
 
     class Meta:
         fields = (
@@ -297,28 +423,16 @@ class SubscribeSerializer(serializers.ModelSerializer):
         )
         model = CustomUser
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
     def validate_subscription(self, user, author):
         if user == author:
             raise serializers.ValidationError(
                 {'detail': 'Нельзя подписаться на себя!'}
             )
 
-        _, created = Subscribe.objects.get_or_create(
-            user=user,
-            following=author
-        )
-        if not created:
+        try:
+            with transaction.atomic():
+                Subscribe.create(user=user, following=author)
+        except IntegrityError:
             raise serializers.ValidationError(
                 {'detail': 'Пользователь уже подписан на данного автора'}
             )
-
-    def validate_unsubscription(self, user, author):
-        subscription = Subscribe.objects.filter(user=user, following=author)
-        if not subscription:
-            raise serializers.ValidationError(
-                {'detail': 'Пользователь не подписан на данного автора'}
-            )
-        return subscription
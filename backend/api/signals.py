@@ -0,0 +1,120 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, Subscribe, Tag,
+                            recipe_amounts, update_counter)
+from recipes.renditions import schedule_renditions
+from recipes.search import index_recipes, unindex_recipe
+from rest_framework.authtoken.models import Token
+from users.models import CustomUser
+
+from .authentication import UNCACHED_USER_FIELDS, revoke_token
+from .cache import bump_version
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredients(sender, **kwargs):
+    bump_version('ingredients')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    bump_version('tags')
+
+
+@receiver(post_save, sender=Recipe)
+def index_recipe(sender, instance, **kwargs):
+    """Поисковые данные считаются после коммита, когда ингредиенты
+    рецепта уже записаны"""
+    transaction.on_commit(lambda: index_recipes(instance.pk))
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe_on_delete(sender, instance, **kwargs):
+    unindex_recipe(instance.pk)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_from_shopping_lists(sender, instance, **kwargs):
+    """Рецепт вычитается из списков покупок при любом удалении, пока
+    его корзины и ингредиенты ещё не удалены каскадом"""
+    ShoppingListItem.recipe_changed(instance, recipe_amounts(instance, -1))
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(sender, instance, **kwargs):
+    """Счётчик автора уменьшается при любом удалении рецепта: через
+    экземпляр, QuerySet.delete(), админку и каскадом"""
+    update_counter(
+        CustomUser.objects.filter(pk=instance.author_id), 'recipes_count', -1)
+
+
+@receiver(pre_delete, sender=CustomUser)
+def decrement_user_link_counters(sender, instance, **kwargs):
+    """Избранное, корзина и подписки пользователя удаляются каскадом
+    мимо remove(); счётчики рецептов и авторов уменьшаются заранее"""
+    for model, counter in ((Favorite, 'favorites_count'),
+                           (ShoppingCart, 'in_cart_count')):
+        update_counter(
+            Recipe.objects.filter(pk__in=model.objects.filter(
+                user=instance).values('recipe_id')),
+            counter,
+            -1
+        )
+    update_counter(
+        CustomUser.objects.filter(pk__in=Subscribe.objects.filter(
+            user=instance).values('following_id')),
+        'followers_count',
+        -1
+    )
+
+
+@receiver(post_save, sender=Ingredient)
+def reindex_ingredient_recipes(sender, instance, created, **kwargs):
+    if created:
+        return
+    recipe_ids = list(IngredientRecipe.objects.filter(
+        ingredient=instance
+    ).values_list('recipe_id', flat=True))
+
+    def reindex():
+        for recipe_id in recipe_ids:
+            index_recipes(recipe_id)
+
+    transaction.on_commit(reindex)
+
+
+@receiver(post_save, sender=Recipe)
+def make_image_renditions(sender, instance, update_fields=None, **kwargs):
+    if not instance.image:
+        return
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    image_name = instance.image.name
+    transaction.on_commit(lambda: schedule_renditions(image_name))
+
+
+@receiver(post_delete, sender=Token)
+def revoke_deleted_token(sender, instance, **kwargs):
+    revoke_token(instance.key)
+
+
+@receiver(post_save, sender=CustomUser)
+def revoke_user_tokens(sender, instance, created, update_fields=None,
+                       **kwargs):
+    """Смена пароля, блокировка и любые другие изменения пользователя
+    сбрасывают его закэшированные токены. Сохранение только
+    некэшируемых полей (last_login при входе) их не трогает"""
+    if created:
+        return
+    if update_fields is not None and 'password' not in update_fields and (
+        set(update_fields) <= set(UNCACHED_USER_FIELDS)
+    ):
+        return
+    for key in Token.objects.filter(user=instance).values_list(
+        'key', flat=True
+    ):
+        revoke_token(key)
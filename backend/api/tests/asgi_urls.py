@@ -0,0 +1,10 @@
+"""Маршруты API в том виде, в каком они подключаются под ASGI
+(SERVER_INTERFACE=asgi)"""
+from django.urls import include, path
+
+from .. import urls
+from ..async_views import async_patterns
+
+urlpatterns = [
+    path('api/', include(async_patterns(urls.urlpatterns))),
+]
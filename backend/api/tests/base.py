@@ -0,0 +1,134 @@
+import base64
+import tempfile
+import threading
+from io import BytesIO
+
+from django.core.cache import cache
+from django.db import connections
+from django.test import override_settings
+from PIL import Image
+from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag, TagRecipe
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+from users.models import CustomUser
+
+from ..authentication import token_cache
+
+
+def png(color='red', size=(32, 24)):
+    """Содержимое PNG-файла"""
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def make_image(color='red', size=(32, 24)):
+    """Изображение в base64, как его присылает фронтенд"""
+    return 'data:image/png;base64,' + base64.b64encode(
+        png(color, size)).decode()
+
+
+def run_parallel(function, arguments):
+    """Вызывает function с каждым из arguments в отдельном потоке,
+    по возможности одновременно; возвращает результаты по порядку"""
+    barrier = threading.Barrier(len(arguments))
+    results = [None] * len(arguments)
+
+    def worker(index, argument):
+        try:
+            barrier.wait()
+            results[index] = function(argument)
+        finally:
+            connections.close_all()
+
+    threads = [
+        threading.Thread(target=worker, args=(index, argument))
+        for index, argument in enumerate(arguments)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class FactoryMixin:
+    """Фабрики данных для тестов API"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        token_cache.clear()
+
+    def use_temporary_media(self):
+        """Файлы теста пишутся во временный MEDIA_ROOT"""
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        return media.name
+
+    @staticmethod
+    def make_user(username):
+        return CustomUser.objects.create_user(
+            email=f'{username}@example.org',
+            username=username,
+            password='password-123',
+            first_name=username,
+            last_name=username,
+        )
+
+    @staticmethod
+    def make_tags(count):
+        return [
+            Tag.objects.create(
+                name=f'tag{number}',
+                slug=f'tag{number}',
+                color=f'#0000{number:02d}'
+            )
+            for number in range(count)
+        ]
+
+    @staticmethod
+    def make_ingredients(count):
+        return [
+            Ingredient.objects.create(
+                name=f'ingredient{number}', measurement_unit='г')
+            for number in range(count)
+        ]
+
+    @staticmethod
+    def make_recipe(author, tags=(), ingredients=(), amount=10):
+        recipe = Recipe.objects.create(
+            author=author,
+            name='recipe',
+            text='text',
+            cooking_time=5,
+        )
+        TagRecipe.objects.bulk_create(
+            TagRecipe(recipe=recipe, tag=tag) for tag in tags
+        )
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe=recipe, ingredient=ingredient, amount=amount)
+            for ingredient in ingredients
+        )
+        return recipe
+
+    @staticmethod
+    def client_for(user):
+        """Клиент с токеном пользователя, как у фронтенда"""
+        client = APIClient()
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+
+class FoodgramTestCase(FactoryMixin, APITestCase):
+    """Базовый класс тестов API"""
+
+
+class FoodgramTransactionTestCase(FactoryMixin, APITransactionTestCase):
+    """Базовый класс тестов, где запросы идут из нескольких потоков
+    и каждый коммитит свою транзакцию"""
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+from unittest import mock
+
+from django.test import override_settings
+from django.urls import resolve
+from recipes.models import Favorite, Subscribe
+
+from .. import async_views
+from .base import FoodgramTransactionTestCase
+
+
+@override_settings(ROOT_URLCONF='api.tests.asgi_urls')
+class AsyncViewsTest(FoodgramTransactionTestCase):
+    """Под ASGI маршруты API те же, что под WSGI, а представления
+    асинхронные; ответы и права доступа не меняются"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('user')
+        author = self.make_user('author')
+        self.recipe = self.make_recipe(
+            author, self.make_tags(1), self.make_ingredients(1))
+        Subscribe.create(self.user, author)
+
+    def assertSameResponse(self, client, path):
+        asynchronous = client.get(path)
+        with override_settings(ROOT_URLCONF='backend.urls'):
+            sync = client.get(path)
+        self.assertEqual(asynchronous.status_code, sync.status_code)
+        self.assertEqual(asynchronous.json(), sync.json())
+        return asynchronous
+
+    def test_views_are_async(self):
+        for path in ('/api/recipes/', f'/api/recipes/{self.recipe.pk}/',
+                     '/api/tags/', '/api/users/subscriptions/',
+                     '/api/auth/token/login/'):
+            with self.subTest(path=path):
+                self.assertTrue(
+                    asyncio.iscoroutinefunction(resolve(path).func))
+
+    def test_subscriptions_require_authentication(self):
+        response = self.assertSameResponse(
+            self.client, '/api/users/subscriptions/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_subscriptions(self):
+        response = self.assertSameResponse(
+            self.client_for(self.user), '/api/users/subscriptions/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_recipes(self):
+        response = self.assertSameResponse(self.client, '/api/recipes/')
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_reads_run_in_pool(self):
+        threads = []
+        run_view = async_views._run_view
+
+        def record(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return run_view(*args, **kwargs)
+
+        client = self.client_for(self.user)
+        with mock.patch.object(async_views, '_run_view', record):
+            self.assertEqual(client.get('/api/tags/').status_code, 200)
+            response = client.post(
+                f'/api/recipes/{self.recipe.pk}/favorite/')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Favorite.objects.filter(user=self.user).exists())
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('async-read'))
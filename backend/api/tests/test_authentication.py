@@ -0,0 +1,129 @@
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from ..authentication import (cache_key, revocation_key, revoke_token,
+                              token_cache)
+from ..cache import version_key
+from .base import FoodgramTestCase
+
+
+class TokenCacheTest(FoodgramTestCase):
+    """Токены из кэша: без запросов к БД на тёплых запросах, отзыв
+    затрагивает только токены изменённого пользователя"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('user')
+        self.other = self.make_user('other')
+        self.client = self.client_for(self.user)
+        self.key = Token.objects.get(user=self.user).key
+
+    def auth_queries(self, client=None):
+        """Запросы к таблицам токенов и пользователей за один GET"""
+        with CaptureQueriesContext(connection) as context:
+            response = (client or self.client).get('/api/tags/')
+        queries = [
+            query['sql'] for query in context.captured_queries
+            if 'authtoken_token' in query['sql']
+            or 'users_customuser' in query['sql']
+        ]
+        return response, queries
+
+    def test_warm_request_does_not_query_auth(self):
+        response, queries = self.auth_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(queries)
+        response, queries = self.auth_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+
+    def test_login_keeps_other_tokens(self):
+        self.auth_queries()
+        response = APIClient().post('/api/auth/token/login/', {
+            'email': self.other.email, 'password': 'password-123'})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.auth_queries()[1], [])
+
+    def test_login_keeps_own_tokens(self):
+        self.auth_queries()
+        response = APIClient().post('/api/auth/token/login/', {
+            'email': self.user.email, 'password': 'password-123'})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.auth_queries()[1], [])
+
+    def test_logout_revokes(self):
+        self.auth_queries()
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.auth_queries()[0].status_code, 401)
+
+    def test_password_change_revokes(self):
+        self.auth_queries()
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'password-123',
+            'new_password': 'new-password-456'})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertTrue(self.auth_queries()[1])
+
+    def test_deactivation_revokes(self):
+        self.auth_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.auth_queries()[0].status_code, 401)
+
+    def test_stale_read_is_not_cached(self):
+        """Запись, прочитанная из БД до отзыва, не попадает в кэш"""
+        generation = token_cache.generation
+        revoke_token(self.key)
+        token_cache.set(cache_key(self.key), 'stale', generation)
+        self.assertIsNone(token_cache.get(cache_key(self.key)))
+
+
+@override_settings(TOKEN_CACHE_SHARED=True)
+class SharedTokenCacheTest(TokenCacheTest):
+    """Отзыв в другом процессе: локальная копия с прежней отметкой
+    об отзыве не принимается, копии других токенов остаются"""
+
+    def local_copy(self, key):
+        return token_cache.get(cache_key(key))
+
+    def test_revoked_elsewhere(self):
+        self.auth_queries()
+        copy = self.local_copy(self.key)
+        Token.objects.filter(user=self.user).delete()
+        # Копия в LRU другого процесса переживает отзыв
+        token_cache.set(cache_key(self.key), copy)
+        self.assertEqual(self.auth_queries()[0].status_code, 401)
+
+    def test_other_revocation_keeps_local_copy(self):
+        self.auth_queries()
+        other = self.client_for(self.other)
+        self.auth_queries(other)
+        self.other.is_active = False
+        self.other.save()
+        self.assertEqual(self.auth_queries(other)[0].status_code, 401)
+        self.assertEqual(self.auth_queries()[1], [])
+
+    def test_revocation_marker_expires(self):
+        """Отметка об отзыве — отдельный ключ со временем жизни,
+        а не вечная версия справочника"""
+        self.auth_queries()
+        name = cache_key(self.key)
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            Token.objects.filter(user=self.user).delete()
+        timeouts = [
+            call.args[2] for call in cache_set.call_args_list
+            if call.args[0] == revocation_key(name)
+        ]
+        self.assertEqual(len(timeouts), 1)
+        self.assertFalse(revocation_key(name).startswith('reference:'))
+        self.assertGreaterEqual(timeouts[0], settings.TOKEN_CACHE_TIMEOUT)
+        self.assertIsNone(cache.get(version_key(name)))
+        self.assertEqual(self.auth_queries()[0].status_code, 401)
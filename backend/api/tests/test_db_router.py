@@ -0,0 +1,116 @@
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.test import SimpleTestCase, override_settings
+from recipes.models import Recipe
+from rest_framework.authtoken.models import Token
+from users.models import CustomUser
+
+from backend.db_router import (ReplicaRouter, read_alias, sticky_key,
+                               unavailable_until)
+
+from ..views import RecipeViewSet
+from .base import FoodgramTransactionTestCase
+
+# Реплика для тестов — зеркало основной БД, как реплики из DB_REPLICAS.
+# Добавляется до создания тестовых БД, пока собираются тесты
+REPLICA = 'replica1'
+settings.DATABASES.setdefault(REPLICA, dict(
+    settings.DATABASES[DEFAULT_DB_ALIAS], TEST={'MIRROR': DEFAULT_DB_ALIAS}))
+
+
+class ReplicaRouterTest(SimpleTestCase):
+    """Чтения выбранной реплики и исключения из них"""
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.addCleanup(read_alias.reset, read_alias.set(REPLICA))
+
+    def test_replica_reads(self):
+        self.assertEqual(self.router.db_for_read(Recipe), REPLICA)
+        self.assertEqual(self.router.db_for_read(CustomUser), REPLICA)
+
+    def test_token_reads_from_primary(self):
+        """Токен, выданный только что, ищется в основной БД: запрос
+        сразу после входа не привязан к ней и не должен получить 401"""
+        self.assertEqual(self.router.db_for_read(Token), DEFAULT_DB_ALIAS)
+
+    def test_writes_go_to_primary(self):
+        self.assertEqual(self.router.db_for_write(Recipe), DEFAULT_DB_ALIAS)
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA])
+class DatabaseRoutingMiddlewareTest(FoodgramTransactionTestCase):
+    """Выбор БД для запроса: реплика для представлений с replica_reads,
+    основная БД после записи клиента и при недоступной реплике"""
+    databases = {DEFAULT_DB_ALIAS, REPLICA}
+
+    def setUp(self):
+        super().setUp()
+        unavailable_until.clear()
+        self.addCleanup(unavailable_until.clear)
+        self.user = self.make_user('user')
+        self.client = self.client_for(self.user)
+        self.recipe = self.make_recipe(self.make_user('author'))
+
+    def recipe_reads(self, client, path='/api/recipes/'):
+        """Алиасы БД, из которых запрос читал рецепты"""
+        aliases = set()
+
+        def record(execute, sql, params, many, context):
+            if '"recipes_recipe"' in sql:
+                aliases.add(context['connection'].alias)
+            return execute(sql, params, many, context)
+
+        with connections[DEFAULT_DB_ALIAS].execute_wrapper(record), \
+                connections[REPLICA].execute_wrapper(record):
+            response = client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return aliases
+
+    def test_replica_reads_opt_in(self):
+        self.assertEqual(self.recipe_reads(self.client), {REPLICA})
+        self.assertEqual(
+            self.recipe_reads(self.client, f'/api/recipes/{self.recipe.pk}/'),
+            {REPLICA}
+        )
+        with mock.patch.object(RecipeViewSet, 'replica_reads', False):
+            self.assertEqual(
+                self.recipe_reads(self.client), {DEFAULT_DB_ALIAS})
+
+    def test_sticky_after_write(self):
+        response = self.client.post(
+            f'/api/recipes/{self.recipe.pk}/favorite/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.recipe_reads(self.client), {DEFAULT_DB_ALIAS})
+        # Остальные клиенты по-прежнему читают из реплики
+        other = self.client_for(self.make_user('other'))
+        self.assertEqual(self.recipe_reads(other), {REPLICA})
+        # Окно DB_REPLICA_STICKY_SECONDS истекло
+        cache.delete(sticky_key(
+            self.client._credentials['HTTP_AUTHORIZATION']))
+        self.assertEqual(self.recipe_reads(self.client), {REPLICA})
+
+    def test_failed_write_not_sticky(self):
+        response = self.client.post('/api/recipes/abc/favorite/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.recipe_reads(self.client), {REPLICA})
+
+    def test_replica_down(self):
+        """Недоступная реплика пропускается на DB_REPLICA_RETRY_SECONDS,
+        чтения идут в основную БД"""
+        with mock.patch.object(
+            connections[REPLICA], 'ensure_connection',
+            side_effect=OperationalError('replica is down')
+        ) as ensure_connection:
+            self.assertEqual(
+                self.recipe_reads(self.client), {DEFAULT_DB_ALIAS})
+            self.assertIn(REPLICA, unavailable_until)
+            self.assertEqual(
+                self.recipe_reads(self.client), {DEFAULT_DB_ALIAS})
+        ensure_connection.assert_called_once()
+        # Время повторной попытки наступило, реплика снова доступна
+        unavailable_until[REPLICA] = 0
+        self.assertEqual(self.recipe_reads(self.client), {REPLICA})
@@ -0,0 +1,54 @@
+from django.test import override_settings
+from recipes.models import FeedEntry, Subscribe
+
+from .base import FoodgramTestCase
+
+
+@override_settings(FEED_FANOUT_MAX_FOLLOWERS=1)
+class FeedTest(FoodgramTestCase):
+    """Лента не теряет рецепты, когда число подписчиков автора
+    переходит FEED_FANOUT_MAX_FOLLOWERS"""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.make_user('author')
+        self.reader = self.make_user('reader')
+        self.other = self.make_user('other')
+
+    def feed(self, user):
+        return FeedEntry.recipe_ids(user, 10)
+
+    def test_pulled_recipe_survives_unfollow(self):
+        Subscribe.create(self.reader, self.author)
+        Subscribe.create(self.other, self.author)
+        recipe = self.make_recipe(self.author)
+        self.assertFalse(recipe.fanned_out)
+        Subscribe.remove(self.other, self.author)
+        self.assertEqual(self.feed(self.reader), [recipe.pk])
+
+    def test_fanned_out_recipe_survives_follow(self):
+        Subscribe.create(self.reader, self.author)
+        recipe = self.make_recipe(self.author)
+        self.assertTrue(recipe.fanned_out)
+        Subscribe.create(self.other, self.author)
+        self.assertEqual(self.feed(self.reader), [recipe.pk])
+        self.assertEqual(self.feed(self.other), [recipe.pk])
+
+    def test_mixed_feed(self):
+        Subscribe.create(self.reader, self.author)
+        fanned_out = self.make_recipe(self.author)
+        Subscribe.create(self.other, self.author)
+        pulled = self.make_recipe(self.author)
+        Subscribe.remove(self.other, self.author)
+        self.assertEqual(
+            self.feed(self.reader), [pulled.pk, fanned_out.pk])
+        self.assertEqual(
+            FeedEntry.recipe_ids(self.reader, 10, before=pulled.pk),
+            [fanned_out.pk])
+
+    def test_unfollow_clears_feed(self):
+        Subscribe.create(self.reader, self.author)
+        Subscribe.create(self.other, self.author)
+        self.make_recipe(self.author)
+        Subscribe.remove(self.reader, self.author)
+        self.assertEqual(self.feed(self.reader), [])
@@ -0,0 +1,175 @@
+import base64
+import hashlib
+import os
+import time
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from recipes.models import Recipe
+from recipes.renditions import RENDITION_EXTENSION, RENDITIONS, make_renditions
+from recipes.storage import recipe_image_storage
+
+from ..serializers import Base64ImageField
+from .base import FoodgramTestCase, make_image, png
+
+
+class RenditionTest(FoodgramTestCase):
+    """Ссылки на копии строятся по флагу рецепта, без обращений
+    к хранилищу"""
+
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_media()
+        self.recipe = self.make_recipe(self.make_user('author'))
+        self.recipe.image = recipe_image_storage.save(
+            'recipes/images/image.png', ContentFile(png()))
+        self.recipe.save(update_fields=['image'])
+
+    def renditions(self):
+        with mock.patch.object(
+            FileSystemStorage, 'exists', autospec=True
+        ) as exists:
+            list_response = self.client.get('/api/recipes/')
+            detail_response = self.client.get(
+                f'/api/recipes/{self.recipe.pk}/')
+        exists.assert_not_called()
+        renditions = list_response.json()['results'][0]['image_renditions']
+        self.assertEqual(
+            renditions, detail_response.json()['image_renditions'])
+        return renditions
+
+    def test_original_until_ready(self):
+        original = self.client.get(
+            f'/api/recipes/{self.recipe.pk}/').json()['image']
+        self.assertEqual(
+            self.renditions(),
+            {rendition: original for rendition in RENDITIONS}
+        )
+
+    def test_renditions_when_ready(self):
+        make_renditions(self.recipe.image.name)
+        self.assertTrue(
+            Recipe.objects.get(pk=self.recipe.pk).renditions_ready)
+        for rendition, url in self.renditions().items():
+            name = url.split('/media/', 1)[1]
+            self.assertTrue(
+                name.endswith(f'_{rendition}.{RENDITION_EXTENSION}'))
+            self.assertTrue(recipe_image_storage.exists(name))
+
+    def patch(self, data):
+        client = self.client_for(self.recipe.author)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.patch(
+                f'/api/recipes/{self.recipe.pk}/', data, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.recipe.refresh_from_db()
+        return next(
+            query['sql'] for query in queries
+            if query['sql'].startswith('UPDATE "recipes_recipe" SET "name"'))
+
+    def test_update_without_image_keeps_renditions(self):
+        make_renditions(self.recipe.image.name)
+        update = self.patch({'text': 'changed'})
+        self.assertNotIn('"image"', update)
+        self.assertNotIn('"renditions_ready"', update)
+        self.assertTrue(self.recipe.renditions_ready)
+
+    def test_same_image_keeps_renditions(self):
+        make_renditions(self.recipe.image.name)
+        update = self.patch({'image': make_image()})
+        self.assertNotIn('"image"', update)
+        self.assertTrue(self.recipe.renditions_ready)
+
+    def test_new_image_resets_renditions(self):
+        make_renditions(self.recipe.image.name)
+        previous = self.recipe.image.name
+        update = self.patch({'image': make_image('blue')})
+        self.assertIn('"renditions_ready"', update)
+        self.assertNotEqual(self.recipe.image.name, previous)
+        self.assertFalse(self.recipe.renditions_ready)
+
+
+class Base64ImageFieldTest(FoodgramTestCase):
+    """Декодирование base64 по частям"""
+
+    def test_wrapped_payload(self):
+        """base64 с переносами строк (MIME) длиннее одной части"""
+        buffer = BytesIO()
+        Image.frombytes('RGB', (160, 160), os.urandom(160 * 160 * 3)).save(
+            buffer, 'PNG')
+        content = buffer.getvalue()
+        encoded = base64.encodebytes(content).decode()
+        self.assertGreater(len(encoded), Base64ImageField.chunk_size)
+        self.assertIn('\n', encoded)
+        image = Base64ImageField().to_internal_value(
+            'data:image/png;base64,' + encoded)
+        image.seek(0)
+        self.assertEqual(image.read(), content)
+
+
+class ContentAddressedStorageTest(FoodgramTestCase):
+    """Изображения хранятся по хэшу содержимого, gc_media удаляет
+    только давно не использованные"""
+
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_media()
+        self.content = png()
+        self.name = recipe_image_storage.save(
+            'recipes/images/image.png', ContentFile(self.content))
+
+    def make_old(self, name):
+        old = time.time() - 7200
+        os.utime(recipe_image_storage.path(name), (old, old))
+
+    def gc_media(self):
+        call_command('gc_media', grace=3600, stdout=StringIO())
+
+    def test_named_by_content(self):
+        self.assertEqual(
+            self.name,
+            'recipes/images/{}.png'.format(
+                hashlib.sha256(self.content).hexdigest())
+        )
+
+    def test_upload_named_by_content(self):
+        client = self.client_for(self.make_user('author'))
+        ingredient, = self.make_ingredients(1)
+        response = client.post('/api/recipes/', {
+            'name': 'recipe',
+            'text': 'text',
+            'cooking_time': 5,
+            'image': 'data:image/png;base64,' + base64.b64encode(
+                self.content).decode(),
+            'tags': [tag.pk for tag in self.make_tags(1)],
+            'ingredients': [{'id': ingredient.pk, 'amount': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(
+            Recipe.objects.get(pk=response.json()['id']).image.name,
+            self.name
+        )
+
+    def test_old_orphan_removed(self):
+        self.make_old(self.name)
+        self.gc_media()
+        self.assertFalse(recipe_image_storage.exists(self.name))
+
+    def test_reupload_protects_orphan(self):
+        """Повторная загрузка файла, уже ставшего мусором, обновляет
+        время изменения, и gc_media не удаляет его до сохранения
+        рецепта"""
+        self.make_old(self.name)
+        self.assertEqual(
+            recipe_image_storage.save(
+                'recipes/images/other.png', ContentFile(self.content)),
+            self.name
+        )
+        self.gc_media()
+        self.assertTrue(recipe_image_storage.exists(self.name))
@@ -0,0 +1,52 @@
+from django.db import connection
+from recipes.models import (Favorite, IngredientRecipe, Recipe, ShoppingCart,
+                            TagRecipe)
+
+from .base import FoodgramTestCase
+
+
+class IndexUsageTest(FoodgramTestCase):
+    """Частые выборки по связям идут по индексам, а не перебором таблицы.
+
+    В PostgreSQL на маленьких таблицах планировщик выбирает Seq Scan,
+    поэтому он отключается: тест проверяет, что индекс есть и подходит.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('user')
+        self.recipe = self.make_recipe(
+            self.user, self.make_tags(2), self.make_ingredients(2))
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertIndexScan(self, queryset):
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            self.assertIn('Index', plan)
+            self.assertNotIn('Seq Scan', plan)
+            self.assertNotIn('Sort', plan)
+        else:
+            self.assertIn('USING', plan)
+            self.assertNotRegex(plan, r'\bSCAN\b')
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_favorite_lookup(self):
+        self.assertIndexScan(Favorite.objects.filter(
+            user=self.user, recipe=self.recipe))
+
+    def test_shopping_cart_lookup(self):
+        self.assertIndexScan(ShoppingCart.objects.filter(
+            user=self.user, recipe=self.recipe))
+
+    def test_recipe_tags(self):
+        self.assertIndexScan(TagRecipe.objects.filter(recipe=self.recipe))
+
+    def test_recipe_ingredients(self):
+        self.assertIndexScan(
+            IngredientRecipe.objects.filter(recipe=self.recipe))
+
+    def test_author_recipes(self):
+        self.assertIndexScan(
+            Recipe.objects.filter(author=self.user).order_by('-id'))
@@ -0,0 +1,134 @@
+from unittest import mock
+
+from django.conf import settings
+from django.test import override_settings
+from django.urls import URLResolver, resolve
+from recipes.models import Favorite, ShoppingCart, Subscribe
+
+from backend.middleware import get_query_budget, get_view_class
+
+from .. import urls
+from .base import FoodgramTransactionTestCase, make_image
+
+
+def budgeted_endpoints(patterns=urls.urlpatterns):
+    """Имена эндпоинтов api/urls.py, для которых представление
+    объявило бюджет запросов (атрибут query_budget)"""
+    names = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            names |= budgeted_endpoints(pattern.url_patterns)
+            continue
+        callback = pattern.callback
+        actions = getattr(callback, 'actions', None)
+        view_class = get_view_class(callback)
+        methods = actions or {
+            method: None for method in view_class.http_method_names
+            if hasattr(view_class, method)
+        }
+        for method in methods:
+            name, budget = get_query_budget(callback, method)
+            if budget:
+                names.add(name)
+    return names
+
+
+@override_settings(
+    MIDDLEWARE=settings.MIDDLEWARE + [
+        'backend.middleware.RequestProfilingMiddleware'],
+    QUERY_BUDGET=0,
+    QUERY_BUDGET_STRICT=True,
+)
+@mock.patch('api.signals.schedule_renditions')
+class QueryBudgetTest(FoodgramTransactionTestCase):
+    """Каждый эндпоинт с query_budget укладывается в свой бюджет.
+
+    Запросы идут через RequestProfilingMiddleware в строгом режиме:
+    превышение бюджета поднимает QueryBudgetExceeded. Транзакции
+    коммитятся, поэтому запросы on_commit (поисковый индекс) тоже
+    считаются; копии изображений строятся вне запроса и отключены.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_media()
+        self.user = self.make_user('user')
+        self.author = self.make_user('author')
+        self.tags = self.make_tags(3)
+        self.ingredients = self.make_ingredients(10)
+        self.recipes = [
+            self.make_recipe(self.author, self.tags, self.ingredients)
+            for _ in range(8)
+        ]
+        self.other = self.make_user('other')
+        Subscribe.create(self.user, self.author)
+        for recipe in self.recipes[:3]:
+            Favorite.create(self.user, recipe)
+            ShoppingCart.create(self.user, recipe)
+        self.client = self.client_for(self.user)
+        self.client.get('/api/tags/')
+
+    def recipe_payload(self):
+        return {
+            'name': 'recipe',
+            'text': 'text',
+            'cooking_time': 5,
+            'image': make_image(),
+            'tags': [tag.pk for tag in self.tags[:2]],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 5}
+                for ingredient in self.ingredients
+            ],
+        }
+
+    def cases(self):
+        """(метод, путь, данные, ожидаемый статус); пути к объектам
+        считаются при вызове, после предыдущих запросов"""
+        recipe = self.recipes[-1].pk
+        own = self.make_recipe(self.user, self.tags, self.ingredients).pk
+        batch = {'recipes': [item.pk for item in self.recipes]}
+        return [
+            ('get', '/api/users/', None, 200),
+            ('get', '/api/users/subscriptions/?recipes_limit=2', None, 200),
+            ('post', f'/api/users/{self.other.pk}/subscribe/', None, 200),
+            ('delete', f'/api/users/{self.other.pk}/subscribe/', None, 204),
+            ('get', '/api/recipes/', None, 200),
+            ('get', '/api/recipes/?tags=tag0&tags=tag1&is_favorited=1',
+             None, 200),
+            ('get', f'/api/recipes/{recipe}/', None, 200),
+            ('get', '/api/recipes/feed/', None, 200),
+            ('post', '/api/recipes/', self.recipe_payload(), 201),
+            ('put', f'/api/recipes/{own}/', self.recipe_payload(), 200),
+            ('patch', f'/api/recipes/{own}/',
+             {'ingredients': self.recipe_payload()['ingredients'][:5]},
+             200),
+            ('post', f'/api/recipes/{recipe}/favorite/', None, 201),
+            ('delete', f'/api/recipes/{recipe}/favorite/', None, 204),
+            ('post', f'/api/recipes/{recipe}/shopping_cart/', None, 201),
+            ('delete', f'/api/recipes/{recipe}/shopping_cart/', None, 204),
+            ('post', '/api/recipes/favorite/', batch, 200),
+            ('delete', '/api/recipes/favorite/', batch, 200),
+            ('post', '/api/recipes/shopping_cart/', batch, 200),
+            ('delete', '/api/recipes/shopping_cart/', batch, 200),
+            ('get', '/api/recipes/download_shopping_cart/', None, 200),
+            ('get', '/api/ingredients/', None, 200),
+            ('get', '/api/ingredients/?name=ingredient1', None, 200),
+            ('get', f'/api/ingredients/{self.ingredients[0].pk}/', None, 200),
+            ('get', '/api/tags/', None, 200),
+            ('get', f'/api/tags/{self.tags[0].pk}/', None, 200),
+        ]
+
+    def test_budgets(self, schedule_renditions):
+        exercised = set()
+        for method, path, data, expected in self.cases():
+            name, budget = get_query_budget(
+                resolve(path.split('?')[0]).func, method)
+            with self.subTest(method=method, path=path, view=name):
+                self.assertTrue(budget, f'{name}: бюджет не объявлен')
+                response = getattr(self.client, method)(
+                    path, data, format='json')
+                self.assertEqual(
+                    response.status_code, expected,
+                    getattr(response, 'data', None))
+            exercised.add(name)
+        self.assertEqual(budgeted_endpoints() - exercised, set())
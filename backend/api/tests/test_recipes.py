@@ -0,0 +1,336 @@
+
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from recipes.models import (Favorite, IngredientRecipe, Recipe, ShoppingCart,
+                            ShoppingListItem, Subscribe, TagRecipe)
+
+from ..filters import RecipeFilter
+from ..views import RecipeViewSet
+from .base import FoodgramTestCase, make_image
+
+IMAGE = make_image()
+
+
+class RecipeListQueriesTest(FoodgramTestCase):
+    """Число запросов списка рецептов не зависит от размера страницы"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('reader')
+        self.tags = self.make_tags(3)
+        self.ingredients = self.make_ingredients(5)
+        self.client = self.client_for(self.user)
+        # Первый запрос кладёт токен в кэш, дальше считаются
+        # только запросы самого эндпоинта
+        self.client.get('/api/tags/')
+
+    def add_recipes(self, count):
+        start = Recipe.objects.count()
+        for number in range(start, start + count):
+            author = self.make_user(f'author{number}')
+            recipe = self.make_recipe(author, self.tags, self.ingredients)
+            Favorite.create(self.user, recipe)
+            ShoppingCart.create(self.user, recipe)
+            Subscribe.create(self.user, author)
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()['results']
+
+    def test_constant_queries(self):
+        self.add_recipes(1)
+        single, results = self.count_list_queries()
+        self.assertEqual(len(results), 1)
+        self.add_recipes(5)
+        full, results = self.count_list_queries()
+        self.assertEqual(len(results), 6)
+        self.assertEqual(single, full)
+        # COUNT(*), страница, авторы, теги, ингредиенты
+        self.assertEqual(full, 5)
+
+    def test_flags_come_from_annotations(self):
+        self.add_recipes(2)
+        _, results = self.count_list_queries()
+        for recipe in results:
+            self.assertTrue(recipe['is_favorited'])
+            self.assertTrue(recipe['is_in_shopping_cart'])
+            self.assertTrue(recipe['author']['is_subscribed'])
+            self.assertEqual(len(recipe['tags']), 3)
+            self.assertEqual(len(recipe['ingredients']), 5)
+
+    def test_anonymous_flags(self):
+        self.add_recipes(2)
+        self.client.credentials()
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/recipes/')
+        for recipe in response.json()['results']:
+            self.assertFalse(recipe['is_favorited'])
+            self.assertFalse(recipe['is_in_shopping_cart'])
+            self.assertFalse(recipe['author']['is_subscribed'])
+
+
+class RecipeWriteQueriesTest(FoodgramTestCase):
+    """Создание и изменение рецепта стоят постоянного числа запросов,
+    изменение пишет только отличающиеся строки"""
+
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_media()
+        self.user = self.make_user('author')
+        self.client = self.client_for(self.user)
+        self.client.get('/api/tags/')
+        self.tags = self.make_tags(3)
+        self.ingredients = self.make_ingredients(20)
+
+    def payload(self, ingredients, amount=10, tags=None):
+        return {
+            'name': 'recipe',
+            'text': 'text',
+            'cooking_time': 5,
+            'image': IMAGE,
+            'tags': [tag.pk for tag in tags or self.tags],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': amount}
+                for ingredient in ingredients
+            ],
+        }
+
+    def create(self, ingredients):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/recipes/', self.payload(ingredients), format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()['id'], len(queries)
+
+    def test_create(self):
+        _, small = self.create(self.ingredients[:2])
+        recipe_id, large = self.create(self.ingredients)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, RecipeViewSet.query_budget['create'])
+        self.assertEqual(
+            IngredientRecipe.objects.filter(recipe_id=recipe_id).count(), 20)
+
+    def update(self, recipe_id, payload):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                f'/api/recipes/{recipe_id}/', payload, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return queries
+
+    def test_update_one_amount(self):
+        counts = []
+        for size in (2, 20):
+            recipe_id, _ = self.create(self.ingredients[:size])
+            payload = self.payload(self.ingredients[:size])
+            payload['ingredients'][0]['amount'] = 20
+            queries = self.update(recipe_id, payload)
+            counts.append(len(queries))
+            writes = [
+                query['sql'] for query in queries
+                if query['sql'].startswith(('INSERT', 'DELETE'))
+                and ('"recipes_ingredientrecipe"' in query['sql']
+                     or '"recipes_tagrecipe"' in query['sql'])
+            ]
+            self.assertEqual(writes, [])
+        self.assertEqual(counts[0], counts[1])
+        self.assertLessEqual(counts[1], RecipeViewSet.query_budget['update'])
+        self.assertEqual(
+            IngredientRecipe.objects.get(
+                recipe_id=recipe_id, ingredient=self.ingredients[0]
+            ).amount,
+            20
+        )
+
+    def test_update_diff(self):
+        recipe_id, _ = self.create(self.ingredients[:3])
+        payload = self.payload(
+            self.ingredients[1:4], amount=7, tags=self.tags[1:])
+        self.update(recipe_id, payload)
+        self.assertEqual(
+            dict(IngredientRecipe.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('ingredient_id', 'amount')),
+            {ingredient.pk: 7 for ingredient in self.ingredients[1:4]}
+        )
+        self.assertEqual(
+            set(TagRecipe.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('tag_id', flat=True)),
+            {tag.pk for tag in self.tags[1:]}
+        )
+
+
+class RecipeFilterTest(FoodgramTestCase):
+    """Фильтры по тегам и связям пользователя — полусоединения:
+    рецепт в выдаче один раз, без DISTINCT"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('user')
+        self.client = self.client_for(self.user)
+        self.client.get('/api/tags/')
+        author = self.make_user('author')
+        first, second, third = self.tags = self.make_tags(3)
+        self.both = self.make_recipe(author, [first, second])
+        self.second = self.make_recipe(author, [second])
+        self.third = self.make_recipe(author, [third])
+        Favorite.create(self.user, self.both)
+        ShoppingCart.create(self.user, self.third)
+
+    def ids(self, query):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/recipes/?' + query)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], len(data['results']))
+        self.queries = [query['sql'] for query in queries]
+        return [recipe['id'] for recipe in data['results']]
+
+    def test_overlapping_tags(self):
+        self.assertEqual(
+            self.ids('tags=tag0&tags=tag1'),
+            [self.second.pk, self.both.pk]
+        )
+        page = next(
+            sql for sql in self.queries
+            if sql.startswith('SELECT "recipes_recipe"."id"')
+        )
+        self.assertNotIn('DISTINCT', page)
+        self.assertNotIn('JOIN "recipes_tagrecipe"', page)
+        self.assertIn('IN (SELECT', page)
+
+    def test_tag_slugs_cached(self):
+        self.ids('tags=tag2')
+        self.assertEqual(self.ids('tags=tag2'), [self.third.pk])
+        self.assertFalse([
+            sql for sql in self.queries
+            if sql.startswith('SELECT "recipes_tag"."slug"')
+        ])
+
+    def test_user_links(self):
+        self.assertEqual(self.ids('is_favorited=1'), [self.both.pk])
+        self.assertEqual(self.ids('is_in_shopping_cart=1'), [self.third.pk])
+        self.assertEqual(
+            self.ids('is_favorited=0&tags=tag1'), [self.second.pk])
+        self.assertEqual(
+            self.ids('is_favorited=1&is_in_shopping_cart=1'), [])
+
+    def test_plan(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        queryset = RecipeFilter(
+            {'tags': ['tag0', 'tag1'], 'is_favorited': 'true'},
+            Recipe.objects.order_by('-id'),
+            request=request
+        ).qs
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            self.assertNotIn('Unique', plan)
+        else:
+            self.assertNotIn('DISTINCT', plan)
+            self.assertRegex(plan, r'INDEX \S*tagrecipe\S* \(tag_id=\?\)')
+            self.assertRegex(
+                plan, r'INDEX \S*favorite\S* \(user_id=\? AND recipe_id=\?\)')
+        self.assertEqual(list(queryset), [self.both])
+
+
+class RecipeOrderingTest(FoodgramTestCase):
+    """Сортировка с равными значениями стабильна: страницы не
+    повторяют и не пропускают рецепты"""
+
+    def test_ties_ordered_by_id(self):
+        author = self.make_user('author')
+        ids = [self.make_recipe(author).pk for _ in range(9)]
+        Favorite.create(self.make_user('user'), Recipe.objects.get(pk=ids[0]))
+        client = self.client_for(author)
+        seen = []
+        for page in (1, 2):
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(
+                    f'/api/recipes/?ordering=-favorites_count&page={page}')
+            self.assertEqual(response.status_code, 200)
+            seen += [recipe['id'] for recipe in response.json()['results']]
+        self.assertEqual(seen, [ids[0]] + sorted(ids[1:], reverse=True))
+        page = next(
+            query['sql'] for query in queries
+            if query['sql'].startswith('SELECT "recipes_recipe"."id"'))
+        self.assertRegex(
+            page, r'ORDER BY "recipes_recipe"."favorites_count" DESC, '
+                  r'"recipes_recipe"."id" DESC')
+
+
+class RecipeDeleteTest(FoodgramTestCase):
+    """Счётчики и списки покупок поддерживаются при любом способе
+    удаления: через экземпляр, QuerySet.delete() и каскадом"""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.make_user('author')
+        self.user = self.make_user('user')
+        self.ingredients = self.make_ingredients(2)
+        self.recipes = [
+            self.make_recipe(self.author, ingredients=self.ingredients,
+                             amount=7)
+            for _ in range(3)
+        ]
+        for recipe in self.recipes:
+            ShoppingCart.create(self.user, recipe)
+
+    def shopping_list(self):
+        return dict(ShoppingListItem.objects.filter(
+            user=self.user).values_list('ingredient_id', 'total'))
+
+    def assertShoppingList(self, total):
+        self.assertEqual(
+            self.shopping_list(),
+            {ingredient.pk: total for ingredient in self.ingredients}
+            if total else {})
+
+    def recipes_count(self):
+        self.author.refresh_from_db()
+        return self.author.recipes_count
+
+    def test_instance_delete(self):
+        self.recipes[0].delete()
+        self.assertEqual(self.recipes_count(), 2)
+        self.assertShoppingList(14)
+
+    def test_queryset_delete(self):
+        Recipe.objects.filter(
+            pk__in=[recipe.pk for recipe in self.recipes[:2]]).delete()
+        self.assertEqual(self.recipes_count(), 1)
+        self.assertShoppingList(7)
+
+    def test_author_cascade(self):
+        self.author.delete()
+        self.assertShoppingList(0)
+
+    def test_user_cascade(self):
+        other = self.make_user('other')
+        Favorite.create(other, self.recipes[0])
+        ShoppingCart.create(other, self.recipes[0])
+        Subscribe.create(other, self.author)
+        other.delete()
+        recipe = Recipe.objects.get(pk=self.recipes[0].pk)
+        self.assertEqual(
+            (recipe.favorites_count, recipe.in_cart_count), (0, 1))
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 0)
+
+
+class RecipeRetrieveTest(FoodgramTestCase):
+    """Некорректный id рецепта — 404, а не ошибка сервера"""
+
+    def test_non_integer_pk(self):
+        client = self.client_for(self.make_user('user'))
+        for method, path in (
+            ('get', '/api/recipes/abc/'),
+            ('post', '/api/recipes/abc/favorite/'),
+            ('post', '/api/recipes/abc/shopping_cart/'),
+        ):
+            with self.subTest(method=method, path=path):
+                response = getattr(client, method)(path)
+                self.assertEqual(response.status_code, 404)
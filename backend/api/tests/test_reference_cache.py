@@ -0,0 +1,78 @@
+from django.test import Client
+from recipes.models import Ingredient, Tag
+from rest_framework.test import APIClient
+from users.models import CustomUser
+
+from ..cache import get_version
+from .base import FoodgramTestCase
+
+
+class ReferenceCacheTest(FoodgramTestCase):
+    """Справочники отдаются из кэша до изменения: правка модели или
+    админки меняет версию, ответ и ETag; повтор ETag даёт 304"""
+
+    def setUp(self):
+        super().setUp()
+        self.tag = self.make_tags(1)[0]
+        self.ingredient = self.make_ingredients(1)[0]
+        self.client = APIClient()
+
+    def admin_client(self):
+        admin = CustomUser.objects.create_superuser(
+            email='admin@example.org', username='admin',
+            password='password-123', first_name='admin', last_name='admin')
+        client = Client()
+        client.force_login(admin)
+        return client
+
+    def test_not_modified(self):
+        response = self.client.get('/api/tags/')
+        etag = response['ETag']
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get(
+            '/api/tags/', HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_model_edit(self):
+        for path, model, instance, name in (
+            ('/api/tags/', Tag, self.tag, 'tags'),
+            (f'/api/ingredients/{self.ingredient.pk}/', Ingredient,
+             self.ingredient, 'ingredients'),
+        ):
+            with self.subTest(name=name):
+                first = self.client.get(path)
+                version = get_version(name)
+                instance.name = 'renamed'
+                instance.save()
+                self.assertGreater(get_version(name), version)
+                response = self.client.get(
+                    path, HTTP_IF_NONE_MATCH=first['ETag'])
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], first['ETag'])
+                self.assertIn('renamed', response.content.decode())
+
+    def test_admin_edit(self):
+        first = self.client.get('/api/tags/')
+        self.assertNotIn('renamed', first.content.decode())
+        response = self.admin_client().post(
+            f'/admin/recipes/tag/{self.tag.pk}/change/',
+            {'name': 'renamed', 'slug': self.tag.slug,
+             'color': self.tag.color})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(
+            '/api/tags/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertIn('renamed', response.content.decode())
+
+    def test_admin_delete(self):
+        first = self.client.get('/api/ingredients/')
+        response = self.admin_client().post(
+            f'/admin/recipes/ingredient/{self.ingredient.pk}/delete/',
+            {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get('/api/ingredients/')
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response.json(), [])
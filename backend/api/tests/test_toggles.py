@@ -0,0 +1,197 @@
+from unittest import skipUnless
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from recipes.models import Favorite, Recipe, ShoppingCart, ShoppingListItem
+
+from .base import FoodgramTestCase, FoodgramTransactionTestCase, run_parallel
+
+
+def recipe_updates(queries):
+    """UPDATE рецепта, кроме приращения счётчиков"""
+    return [
+        query['sql'] for query in queries
+        if query['sql'].startswith('UPDATE "recipes_recipe"')
+        and '_count" = (' not in query['sql']
+    ]
+
+
+def shopping_list(user):
+    return dict(ShoppingListItem.objects.filter(
+        user=user).values_list('ingredient_id', 'total'))
+
+
+class ToggleTest(FoodgramTestCase):
+    """Избранное и список покупок меняют только таблицу связей
+    и счётчик рецепта"""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.make_user('author')
+        self.recipe = self.make_recipe(
+            self.author, ingredients=self.make_ingredients(2))
+
+    def test_no_recipe_update(self):
+        client = self.client_for(self.make_user('user'))
+        for path in ('favorite', 'shopping_cart'):
+            for method in (client.post, client.delete):
+                with CaptureQueriesContext(connection) as queries:
+                    response = method(
+                        f'/api/recipes/{self.recipe.pk}/{path}/')
+                self.assertLess(response.status_code, 300)
+                self.assertEqual(recipe_updates(queries), [])
+
+    def test_stale_recipe_does_not_lose_updates(self):
+        """Счётчик меняется выражением F(): устаревший экземпляр
+        рецепта не перезаписывает чужие изменения"""
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        first, second = self.make_user('first'), self.make_user('second')
+        Favorite.create(first, stale)
+        Favorite.create(second, stale)
+        ShoppingCart.create(first, stale)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 2)
+        self.assertEqual(self.recipe.in_cart_count, 1)
+
+    def test_repeated_add_and_remove(self):
+        client = self.client_for(self.make_user('user'))
+        path = f'/api/recipes/{self.recipe.pk}/favorite/'
+        self.assertEqual(client.post(path).status_code, 201)
+        self.assertEqual(client.post(path).status_code, 400)
+        self.assertEqual(client.delete(path).status_code, 204)
+        self.assertEqual(client.delete(path).status_code, 400)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+
+
+class BatchToggleTest(FoodgramTestCase):
+    """Пакетные изменения меняют счётчики и список покупок только
+    по действительно записанным строкам"""
+
+    def setUp(self):
+        super().setUp()
+        author = self.make_user('author')
+        ingredients = self.make_ingredients(2)
+        self.recipes = [
+            self.make_recipe(author, ingredients=ingredients, amount=10)
+            for _ in range(3)
+        ]
+        self.ids = [recipe.pk for recipe in self.recipes]
+        self.user = self.make_user('user')
+        self.ingredients = [ingredient.pk for ingredient in ingredients]
+
+    def counters(self):
+        return list(Recipe.objects.filter(pk__in=self.ids).order_by(
+            'id').values_list('favorites_count', 'in_cart_count'))
+
+    def test_repeated_batch_is_noop(self):
+        for model in (Favorite, ShoppingCart):
+            self.assertEqual(
+                model.add_many(self.user, self.ids),
+                (self.ids, set(self.ids)))
+            self.assertEqual(model.add_many(self.user, self.ids),
+                             ([], set(self.ids)))
+        self.assertEqual(self.counters(), [(1, 1)] * 3)
+        self.assertEqual(shopping_list(self.user),
+                         dict.fromkeys(self.ingredients, 30))
+        for model in (Favorite, ShoppingCart):
+            self.assertEqual(model.remove_many(self.user, self.ids),
+                             self.ids)
+            self.assertEqual(model.remove_many(self.user, self.ids), [])
+        self.assertEqual(self.counters(), [(0, 0)] * 3)
+        self.assertEqual(shopping_list(self.user), {})
+
+    def test_batch_with_single_toggles(self):
+        ShoppingCart.create(self.user, self.recipes[0])
+        added, found = ShoppingCart.add_many(
+            self.user, self.ids + [max(self.ids) + 1])
+        self.assertEqual(added, self.ids[1:])
+        self.assertEqual(found, set(self.ids))
+        self.assertEqual(shopping_list(self.user),
+                         dict.fromkeys(self.ingredients, 30))
+        self.assertTrue(ShoppingCart.remove(self.user, self.recipes[1]))
+        self.assertEqual(ShoppingCart.remove_many(self.user, self.ids),
+                         [self.ids[0], self.ids[2]])
+        self.assertEqual(self.counters(), [(0, 0)] * 3)
+        self.assertEqual(shopping_list(self.user), {})
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'нужны параллельные транзакции PostgreSQL')
+class ParallelToggleTest(FoodgramTransactionTestCase):
+    """Параллельные переключения не теряют изменений"""
+
+    def setUp(self):
+        super().setUp()
+        self.ingredients = self.make_ingredients(2)
+        self.recipe = self.make_recipe(
+            self.make_user('author'), ingredients=self.ingredients)
+
+    def test_many_users(self):
+        clients = [
+            self.client_for(self.make_user(f'user{number}'))
+            for number in range(8)
+        ]
+        for path, counter in (('favorite', 'favorites_count'),
+                              ('shopping_cart', 'in_cart_count')):
+            url = f'/api/recipes/{self.recipe.pk}/{path}/'
+            statuses = run_parallel(
+                lambda client: client.post(url).status_code, clients)
+            self.assertEqual(statuses, [201] * len(clients))
+            self.recipe.refresh_from_db()
+            self.assertEqual(getattr(self.recipe, counter), len(clients))
+            statuses = run_parallel(
+                lambda client: client.delete(url).status_code, clients)
+            self.assertEqual(statuses, [204] * len(clients))
+            self.recipe.refresh_from_db()
+            self.assertEqual(getattr(self.recipe, counter), 0)
+
+    def test_same_user(self):
+        user = self.make_user('user')
+        clients = [self.client_for(user) for _ in range(4)]
+        for path, model in (('favorite', Favorite),
+                            ('shopping_cart', ShoppingCart)):
+            url = f'/api/recipes/{self.recipe.pk}/{path}/'
+            statuses = run_parallel(
+                lambda client: client.post(url).status_code, clients)
+            self.assertEqual(sorted(statuses), [201, 400, 400, 400])
+            statuses = run_parallel(
+                lambda client: client.delete(url).status_code, clients)
+            self.assertEqual(sorted(statuses), [204, 400, 400, 400])
+            self.recipe.refresh_from_db()
+            self.assertEqual(self.recipe.favorites_count, 0)
+            self.assertEqual(self.recipe.in_cart_count, 0)
+            self.assertFalse(model.objects.exists())
+
+    def test_same_user_batches(self):
+        """Одинаковые пакеты одного пользователя применяются один раз"""
+        ids = [self.recipe.pk] + [
+            self.make_recipe(
+                self.recipe.author, ingredients=self.ingredients).pk
+            for _ in range(3)
+        ]
+        user = self.make_user('user')
+        clients = [self.client_for(user) for _ in range(4)]
+        cart = {
+            ingredient.pk: 10 * len(ids) for ingredient in self.ingredients}
+        for path, counter in (('favorite', 'favorites_count'),
+                              ('shopping_cart', 'in_cart_count')):
+            url = f'/api/recipes/{path}/'
+            for method, status, count in (('post', 'added', 1),
+                                          ('delete', 'removed', 0)):
+                responses = run_parallel(
+                    lambda client: getattr(client, method)(
+                        url, {'recipes': ids}, format='json'),
+                    clients)
+                applied = [
+                    item['id'] for response in responses
+                    for item in response.data['results']
+                    if item['status'] == status
+                ]
+                self.assertEqual(sorted(applied), ids)
+                self.assertEqual(set(Recipe.objects.filter(
+                    pk__in=ids).values_list(counter, flat=True)), {count})
+                self.assertEqual(
+                    shopping_list(user),
+                    cart if (path, method) == ('shopping_cart', 'post')
+                    else {})
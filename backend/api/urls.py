@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from . import async_views
 from .views import (CustomUserViewSet, IngredientViewSet, RecipeViewSet,
                     SetPasswordView, SubscribeViewSet, TagViewSet)
 
@@ -28,3 +30,7 @@ urlpatterns = [
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
 ]
+
+# Под ASGI безопасные запросы идут в пуле потоков, см. async_view
+if settings.SERVER_INTERFACE == 'asgi':
+    urlpatterns = async_views.async_patterns(urlpatterns)
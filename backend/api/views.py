@@ -1,24 +1,31 @@
-from django.db import transaction
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
-                            Subscribe, Tag)
+                            ShoppingListItem, Subscribe, Tag)
 from rest_framework import serializers, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.generics import UpdateAPIView
+from rest_framework.generics import UpdateAPIView, get_object_or_404
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 from users.models import CustomUser
 
-from .filters import IngredientFilter, RecipeFilter
-from .pagination import RecipePagination
+from .cache import ReferenceCacheMixin
+from .filters import IngredientFilter, RecipeFilter, RecipeOrderingFilter
+from .ingredient_index import ingredient_index
+from .pagination import FeedPagination, RecipePagination, get_recipes_limit
 from .permissions import AuthorOrReadOnly, ReadOnly
+from .recipe_reader import read_recipes, recipe_rows
+from .renderers import FastJSONRenderer
 from .serializers import (CustomUserSerializer, IngredientSerializer,
-                          PasswordSerializer, RecipeReadSerializer,
-                          RecipeWriteSerializer, SubscribeRecipeSerializer,
-                          SubscribeSerializer, TagSerializer)
+                          PasswordSerializer, RecipeBatchSerializer,
+                          RecipeReadSerializer, RecipeWriteSerializer,
+                          SubscribeRecipeSerializer, SubscribeSerializer,
+                          TagSerializer)
+from .shopping_list import SHOPPING_LIST_FORMATS
 
 
 class CustomUserViewSet(UserViewSet):
@@ -26,6 +33,14 @@ class CustomUserViewSet(UserViewSet):
     queryset = CustomUser.objects.all()
     serializer_class = CustomUserSerializer
     pagination_class = RecipePagination
+    query_budget = {'list': 3, 'subscriptions': 4}
+    replica_reads = True
+
+    def get_queryset(self):
+        return Subscribe.annotate_subscribed(
+            super().get_queryset(),
+            self.request.user
+        )
 
     @action(
         detail=False,
@@ -34,16 +49,19 @@ class CustomUserViewSet(UserViewSet):
     )
     def subscriptions(self, request):
         """Вывод всех подписок юзера"""
-        user = request.user
-        subscriptions = Subscribe.objects.filter(
-            user=user
-        ).select_related('following')
+        queryset = Subscribe.authors_with_recipes(
+            CustomUser.objects.filter(
+                followers__user=request.user
+            ).order_by('-id'),
+            get_recipes_limit(request)
+        )
+        page = self.paginate_queryset(queryset)
         serializer = SubscribeSerializer(
-            [subscription.following for subscription in subscriptions],
-            many=True
+            page,
+            many=True,
+            context=self.get_serializer_context()
         )
-        queryset = self.paginate_queryset(serializer.data)
-        return self.get_paginated_response(queryset)
+        return self.get_paginated_response(serializer.data)
 
 
 class SetPasswordView(UpdateAPIView):
@@ -68,7 +86,7 @@ class SetPasswordView(UpdateAPIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             self.object.set_password(serializer.data.get('new_password'))
-            self.object.save()
+            self.object.save(update_fields=['password'])
             return Response({'status': 'password set'})
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -76,10 +94,44 @@ class SetPasswordView(UpdateAPIView):
 class RecipeViewSet(viewsets.ModelViewSet):
     """Эндпоинт для работы с моделью Recipe"""
     queryset = Recipe.objects.all().order_by('-id')
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (DjangoFilterBackend, RecipeOrderingFilter)
     filterset_class = RecipeFilter
+    ordering_fields = ('id', 'favorites_count')
+    ordering = ('-id',)
     permission_classes = (AuthorOrReadOnly,)
     pagination_class = RecipePagination
+    query_budget = {
+        'list': 7, 'retrieve': 5, 'create': 16, 'update': 24,
+        'partial_update': 24, 'favorite': 7, 'shopping_cart': 11,
+        'download_shopping_cart': 2, 'feed': 7, 'favorite_batch': 5,
+        'shopping_cart_batch': 9,
+    }
+    replica_reads = True
+
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
+
+    def get_queryset(self):
+        """Для чтения флаги пользователя считаются в том же запросе"""
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+        return queryset.with_user_flags(self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        """Чтение идёт в обход RecipeReadSerializer: словари собираются
+        из values(), вывод совпадает побайтно"""
+        rows = recipe_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(read_recipes(rows, request))
+        return self.get_paginated_response(read_recipes(page, request))
+
+    def retrieve(self, request, *args, **kwargs):
+        row = get_object_or_404(
+            recipe_rows(self.filter_queryset(self.get_queryset())),
+            pk=self.kwargs['pk']
+        )
+        return Response(read_recipes([row], request)[0])
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -87,39 +139,35 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def perform_update(self, serializer):
         super(RecipeViewSet, self).perform_update(serializer)
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+
     @transaction.atomic
     @action(detail=True, methods=['POST', 'DELETE'])
     def favorite(self, request, pk=None):
         """Добавляет рецепт в избранное"""
         user = request.user
         recipe = get_object_or_404(Recipe, pk=pk)
-        serializer = RecipeWriteSerializer()
 
         if request.method == 'POST':
             try:
-                serializer.validate_favorite(user, recipe)
-            except serializers.ValidationError as error:
+                with transaction.atomic():
+                    Favorite.create(user=user, recipe=recipe)
+            except IntegrityError:
                 return Response(
-                    error.detail,
+                    {'detail': 'Рецепт уже добавлен в избранное'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            favorite = Favorite.create(user=user, recipe=recipe)
-
             return Response({'detail': 'Рецепт успешно добавлен в избранное'},
                             status=status.HTTP_201_CREATED)
         if request.method == 'DELETE':
-            try:
-                favorite = serializer.validate_not_favorite(user, recipe)
-            except serializers.ValidationError as error:
+            if not Favorite.remove(user=user, recipe=recipe):
                 return Response(
-                    error.detail,
+                    {'detail': 'Рецепт не добавлен в избранное'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-
-            favorite.delete()
-            recipe.is_favorited = False
-            recipe.save()
             return Response({'detail': 'Рецепт успешно удален из избранного'},
                             status=status.HTTP_204_NO_CONTENT)
 
@@ -131,40 +179,80 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """Добавляет рецепт в список покупок"""
         recipe = get_object_or_404(Recipe, pk=pk)
         user = request.user
-        serializer = RecipeWriteSerializer()
 
         if request.method == 'POST':
             try:
-                serializer.validate_shopping_cart(user, recipe)
-            except serializers.ValidationError as error:
+                with transaction.atomic():
+                    ShoppingCart.create(user=user, recipe=recipe)
+            except IntegrityError:
                 return Response(
-                    error.detail,
+                    {'detail': 'Рецепт уже в списке покупок'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            ShoppingCart.create(user=user, recipe=recipe)
-
             serializer = SubscribeRecipeSerializer(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
-            try:
-                shopping_cart_item = serializer.validate_not_shopping_cart(
-                    user, recipe)
-            except serializers.ValidationError as error:
+            if not ShoppingCart.remove(user=user, recipe=recipe):
                 return Response(
-                    error.detail,
+                    {'detail': 'Рецепт не в списке покупок'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-
-            shopping_cart_item.delete()
-            recipe.is_in_shopping_cart = False
-            recipe.save()
             return Response(
                 {'detail': 'Рецепт успешно удален из списка покупок'},
                 status=status.HTTP_204_NO_CONTENT
             )
 
+    @transaction.atomic
+    @action(detail=False,
+            methods=['POST', 'DELETE'],
+            url_path='favorite',
+            url_name='favorite-batch',
+            permission_classes=[IsAuthenticated])
+    def favorite_batch(self, request):
+        """Добавляет в избранное или убирает из него список рецептов"""
+        return self.change_many(request, Favorite)
+
+    @transaction.atomic
+    @action(detail=False,
+            methods=['POST', 'DELETE'],
+            url_path='shopping_cart',
+            url_name='shopping-cart-batch',
+            permission_classes=[IsAuthenticated])
+    def shopping_cart_batch(self, request):
+        """Добавляет в список покупок или убирает из него список
+        рецептов"""
+        return self.change_many(request, ShoppingCart)
+
+    def change_many(self, request, model):
+        """Одна вставка или одно удаление на весь список; в ответе
+        результат для каждого id: added, exists или not_found при
+        добавлении и removed или missing при удалении"""
+        serializer = RecipeBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        if request.method == 'POST':
+            added, found = model.add_many(request.user, recipe_ids)
+            added = set(added)
+            results = [
+                {'id': recipe_id, 'status': (
+                    'added' if recipe_id in added
+                    else 'exists' if recipe_id in found
+                    else 'not_found'
+                )}
+                for recipe_id in recipe_ids
+            ]
+        else:
+            removed = set(model.remove_many(request.user, recipe_ids))
+            results = [
+                {'id': recipe_id, 'status': (
+                    'removed' if recipe_id in removed else 'missing'
+                )}
+                for recipe_id in recipe_ids
+            ]
+        return Response({'results': results})
+
     def get_serializer_class(self):
         """Определяет какой сериализатор будет использоваться
               для разных типов запроса"""
@@ -176,51 +264,81 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """Определяет какой пермишен будет использоваться"""
         if self.action == 'retrieve':
             return (ReadOnly(),)
+        if self.action in ('download_shopping_cart', 'feed'):
+            return (IsAuthenticated(),)
         return super().get_permissions()
 
     def download_shopping_cart(self, request):
         """Предлагает загрузить список покупок"""
-        user = request.user
-        shopping_cart_items = ShoppingCart.objects.filter(user=user)
-        ingredients = {}
-
-        for item in shopping_cart_items:
-            recipe = item.recipe
-            for ingredient_recipe in recipe.ingredientrecipe_set.all():
-                ingredient = ingredient_recipe.ingredient
-                name = ingredient.name
-                unit = ingredient.measurement_unit
-                if name in ingredients:
-                    ingredients[name]['quantity'] \
-                        += ingredient_recipe.amount
-                else:
-                    ingredients[name] = {
-                        'quantity': ingredient_recipe.amount,
-                        'unit': unit
-                    }
-
-        shopping_list = ""
-        for name, ingredient_data in ingredients.items():
-            shopping_list += (f"{name} ({ingredient_data['unit']})"
-                              f" - {ingredient_data['quantity']}\n")
-        response = HttpResponse(shopping_list, content_type='text/plain')
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response(
+                {'file_format': [
+                    'Допустимые форматы: '
+                    + ', '.join(SHOPPING_LIST_FORMATS)
+                ]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        content_type, render = SHOPPING_LIST_FORMATS[file_format]
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user
+        ).values(
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+            amount=F('total')
+        ).order_by('name')
+        response = StreamingHttpResponse(
+            render(ingredients.iterator()),
+            content_type=content_type
+        )
         response['Content-Disposition'] \
-            = 'attachment; filename="shopping_cart.txt"'
+            = f'attachment; filename="shopping_cart.{file_format}"'
         return response
 
+    @action(detail=False)
+    def feed(self, request):
+        """Новые рецепты авторов, на которых подписан пользователь"""
+        paginator = FeedPagination()
+        recipe_ids = paginator.paginate_feed(request.user, request)
+        rows = {
+            row['id']: row for row in recipe_rows(
+                Recipe.objects.with_user_flags(request.user).filter(
+                    pk__in=recipe_ids)
+            )
+        }
+        return paginator.get_paginated_response(read_recipes(
+            [rows[recipe_id] for recipe_id in recipe_ids
+             if recipe_id in rows],
+            request
+        ))
+
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(ReferenceCacheMixin, viewsets.ModelViewSet):
     """Эндпоинт для работы с моделью Ingredient"""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filter_backends = (IngredientFilter,)
     search_fields = ('^name',)
+    reference_name = 'ingredients'
+    query_budget = {'list': 2, 'retrieve': 2}
+    replica_reads = True
 
+    def list(self, request, *args, **kwargs):
+        """Поиск по имени обслуживается индексом в памяти"""
+        name = request.query_params.get(IngredientFilter.search_param)
+        if name:
+            return self.conditional_response(
+                request, ingredient_index.search(name))
+        return super().list(request, *args, **kwargs)
 
-class TagViewSet(viewsets.ModelViewSet):
+
+class TagViewSet(ReferenceCacheMixin, viewsets.ModelViewSet):
     """Эндпоинт для работы с моделью Tag"""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    reference_name = 'tags'
+    query_budget = {'list': 2, 'retrieve': 2}
+    replica_reads = True
 
 
 class SubscribeViewSet(viewsets.ModelViewSet):
@@ -229,7 +347,9 @@ class SubscribeViewSet(viewsets.ModelViewSet):
     serializer_class = CustomUserSerializer
     permission_classes = (IsAuthenticated,)
     pagination_class = RecipePagination
+    query_budget = {'subscribe': 11}
 
+    @transaction.atomic
     @action(detail=True, methods=['POST', 'DELETE'])
     def subscribe(self, request, *args, **kwargs):
         """Подписка/отписка от автора"""
@@ -246,26 +366,26 @@ class SubscribeViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
+            author.is_subscribed = True
+            author.save(update_fields=['is_subscribed'])
             serializer = SubscribeSerializer(
-                author,
+                Subscribe.authors_with_recipes(
+                    CustomUser.objects.filter(pk=author.pk),
+                    get_recipes_limit(request)
+                ).get(),
                 context={'request': request}
             )
-            author.is_subscribed = True
-            author.save()
             return Response(serializer.data)
 
         if request.method == 'DELETE':
-            try:
-                subscription = serializer.validate_unsubscription(user, author)
-            except serializers.ValidationError as error:
+            if not Subscribe.remove(user=user, following=author):
                 return Response(
-                    error.detail,
+                    {'detail': 'Пользователь не подписан на данного автора'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            subscription.delete()
             author.is_subscribed = False
-            author.save()
+            author.save(update_fields=['is_subscribed'])
             return Response(
                 {'detail': 'Пользователь успешно отписан от данного автора'},
                 status=status.HTTP_204_NO_CONTENT
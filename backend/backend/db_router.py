@@ -0,0 +1,96 @@
+import hashlib
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+# Реплика, из которой читает текущий запрос; None — читать из основной БД
+read_alias = ContextVar('read_alias', default=None)
+# Реплика -> время (time.monotonic()), до которого она считается недоступной
+unavailable_until = {}
+# Всегда читаются из основной БД. Вход идёт без заголовка Authorization,
+# поэтому клиент с новым токеном не привязан к основной БД, а поиск
+# токена (вместе с пользователем) в отстающей реплике вернул бы 401
+PRIMARY_MODELS = {'authtoken.token'}
+
+
+def sticky_key(credentials):
+    """Ключ кэша, пока он жив, клиент читает из основной БД"""
+    return 'db-primary:' + hashlib.sha256(credentials.encode()).hexdigest()
+
+
+def stick_to_primary(credentials):
+    """После записи клиент какое-то время читает свои данные
+    из основной БД, пока реплики их не догнали"""
+    cache.set(
+        sticky_key(credentials), True, settings.DB_REPLICA_STICKY_SECONDS)
+
+
+def is_sticky(credentials):
+    return bool(cache.get(sticky_key(credentials)))
+
+
+def check_connection(alias, connect=False):
+    """Проверка соединения, сохранённого между запросами (CONN_MAX_AGE).
+
+    Разорванное соединение закрывается, чтобы запрос открыл новое, а не
+    упал на первом SQL. С connect=True соединение открывается сразу;
+    возвращает False, если БД недоступна.
+    """
+    connection = connections[alias]
+    if (connection.connection is not None
+            and settings.DB_CONN_HEALTH_CHECKS
+            and not connection.is_usable()):
+        connection.close()
+    if not connect:
+        return True
+    try:
+        connection.ensure_connection()
+    except DatabaseError:
+        return False
+    return True
+
+
+def choose_replica():
+    """Случайная доступная реплика; недоступная пропускается
+    на DB_REPLICA_RETRY_SECONDS"""
+    now = time.monotonic()
+    replicas = [
+        alias for alias in settings.DATABASE_REPLICAS
+        if unavailable_until.get(alias, 0) <= now
+    ]
+    random.shuffle(replicas)
+    for alias in replicas:
+        if check_connection(alias, connect=True):
+            return alias
+        unavailable_until[alias] = now + settings.DB_REPLICA_RETRY_SECONDS
+    return None
+
+
+class ReplicaRouter:
+    """Чтение из реплики, выбранной DatabaseRoutingMiddleware для
+    текущего запроса, всё остальное — в основную БД.
+
+    Чтение без выбранной реплики явно идёт в основную БД: иначе Django
+    читал бы связанные объекты из той БД, откуда загружен сам объект.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = read_alias.get()
+        if (alias is None
+                or model._meta.label_lower in PRIMARY_MODELS
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,171 @@
+import json
+import logging
+import time
+from contextlib import ExitStack
+from http import HTTPStatus
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+from .db_router import (check_connection, choose_replica, is_sticky,
+                        read_alias, stick_to_primary)
+
+logger = logging.getLogger('backend.requests')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Запрос выполнил больше SQL-запросов, чем разрешено"""
+
+
+class QueryCounter:
+    """Обёртка execute_wrapper: считает запросы и время в БД"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+def get_view_class(view_func):
+    """Класс представления, из которого получена view_func"""
+    return getattr(view_func, 'cls', None) or getattr(
+        view_func, 'view_class', view_func)
+
+
+def get_query_budget(view_func, method):
+    """Имя представления и бюджет запросов из его атрибута query_budget.
+
+    Атрибут — число или словарь {действие: число}; для ViewSet действие
+    определяется по методу запроса. Без бюджета берётся QUERY_BUDGET.
+    """
+    view_class = get_view_class(view_func)
+    action = (getattr(view_func, 'actions', None) or {}).get(method.lower())
+    name = view_class.__name__ + (f'.{action}' if action else '')
+    budget = getattr(view_class, 'query_budget', None)
+    if isinstance(budget, dict):
+        budget = budget.get(action)
+    if budget is None:
+        budget = settings.QUERY_BUDGET
+    return name, budget
+
+
+class RequestProfilingMiddleware:
+    """Профилирование запросов к API.
+
+    Считает SQL-запросы и время в БД, время представления без БД
+    (у DRF это в основном сериализация), время рендеринга и размер
+    ответа. Метрики отдаются в заголовке Server-Timing; при превышении
+    бюджета запросов пишется строка в лог, а при QUERY_BUDGET_STRICT
+    поднимается исключение, чтобы CI ловил регрессии.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        request.profile = {'budget': settings.QUERY_BUDGET}
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+        profile = request.profile
+        view = profile.get('view', total)
+        render = profile.get('render', 0.0)
+        size = None if response.streaming else len(response.content)
+        response['Server-Timing'] = ', '.join((
+            'db;dur={:.1f};desc="{} queries"'.format(
+                counter.duration * 1000, counter.count),
+            'serialize;dur={:.1f}'.format(
+                max(view - counter.duration, 0.0) * 1000),
+            'render;dur={:.1f}'.format(render * 1000),
+            'total;dur={:.1f}'.format(total * 1000),
+        ) + (() if size is None else (f'size;desc="{size} bytes"',)))
+        budget = profile['budget']
+        if budget and counter.count > budget:
+            logger.warning(json.dumps({
+                'event': 'query_budget_exceeded',
+                'method': request.method,
+                'path': request.path,
+                'view': profile.get('view_name'),
+                'status': response.status_code,
+                'queries': counter.count,
+                'budget': budget,
+                'db_ms': round(counter.duration * 1000, 1),
+                'total_ms': round(total * 1000, 1),
+                'size': size,
+            }, ensure_ascii=False))
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(
+                    f'{request.method} {request.path}: '
+                    f'{counter.count} запросов при бюджете {budget}'
+                )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_name, budget = get_query_budget(view_func, request.method)
+        request.profile.update(
+            budget=budget,
+            view_name=view_name,
+            view_start=time.perf_counter(),
+        )
+
+    def process_template_response(self, request, response):
+        profile = request.profile
+        view_end = time.perf_counter()
+        profile['view'] = view_end - profile['view_start']
+
+        def rendered(response):
+            profile['render'] = time.perf_counter() - view_end
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+class DatabaseRoutingMiddleware:
+    """Выбор БД для запроса.
+
+    Безопасные запросы к представлениям с replica_reads = True читают
+    из реплики (см. ReplicaRouter), если клиент недавно ничего не менял:
+    после успешного небезопасного запроса его чтения
+    DB_REPLICA_STICKY_SECONDS идут в основную БД. Клиент определяется
+    по заголовку Authorization. Перед запросом проверяется сохранённое
+    соединение с основной БД.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        check_connection(DEFAULT_DB_ALIAS)
+        try:
+            response = self.get_response(request)
+        finally:
+            read_alias.set(None)
+        credentials = request.META.get('HTTP_AUTHORIZATION')
+        if (settings.DATABASE_REPLICAS and credentials
+                and request.method not in SAFE_METHODS
+                and response.status_code < HTTPStatus.BAD_REQUEST):
+            stick_to_primary(credentials)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (not settings.DATABASE_REPLICAS
+                or request.method not in SAFE_METHODS
+                or not getattr(get_view_class(view_func),
+                               'replica_reads', False)):
+            return
+        credentials = request.META.get('HTTP_AUTHORIZATION')
+        if credentials and is_sticky(credentials):
+            return
+        read_alias.set(choose_replica())
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'backend.middleware.DatabaseRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -51,6 +52,14 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Профилирование запросов: заголовок Server-Timing и лог при превышении
+# бюджета SQL-запросов (0 — без общего бюджета). QUERY_BUDGET_STRICT
+# превращает превышение в ошибку, это режим для CI.
+if os.getenv('REQUEST_PROFILING', 'False') == 'True':
+    MIDDLEWARE.append('backend.middleware.RequestProfilingMiddleware')
+QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', 0))
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', 'False') == 'True'
+
 ROOT_URLCONF = 'backend.urls'
 
 TEMPLATES = [
@@ -82,10 +91,89 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', 'django_user'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', '8888'),
         'HOST': os.getenv('DB_HOST', 'localhost'),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        # Соединение живёт между запросами; перед запросом
+        # DatabaseRoutingMiddleware проверяет, что оно не разорвано
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+    }
+}
+
+# DB_ENGINE=sqlite — локальная база в файле, например для manage.py bench
+if os.getenv('DB_ENGINE') == 'sqlite':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+    }
+
+DB_CONN_HEALTH_CHECKS = os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+
+# Реплики для чтения: DB_REPLICAS — через запятую host[:port] (PostgreSQL)
+# или пути к файлам (SQLite, для локальной проверки маршрутизации).
+# Реплики получают алиасы replica1, replica2, ...
+DATABASE_REPLICAS = []
+for number, location in enumerate(
+    filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1
+):
+    replica = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if replica['ENGINE'] == 'django.db.backends.sqlite3':
+        replica['NAME'] = location
+    else:
+        host, _, port = location.partition(':')
+        replica.update(
+            HOST=host,
+            PORT=port or replica['PORT'],
+            # Недоступная реплика не должна надолго задерживать запрос
+            OPTIONS={'connect_timeout': int(
+                os.getenv('DB_REPLICA_CONNECT_TIMEOUT', 2))},
+        )
+    DATABASES[f'replica{number}'] = replica
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['backend.db_router.ReplicaRouter']
+# Сколько секунд после записи клиент читает из основной БД
+DB_REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', 5))
+# Через сколько секунд снова пробовать недоступную реплику
+DB_REPLICA_RETRY_SECONDS = int(os.getenv('DB_REPLICA_RETRY_SECONDS', 30))
+
+
+# Cache
+# По умолчанию кэш локальный для процесса; для нескольких воркеров
+# укажите общий бэкенд, чтобы версии справочников сбрасывались везде.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
     }
 }
 
+REFERENCE_CACHE_TIMEOUT = int(os.getenv('REFERENCE_CACHE_TIMEOUT', 60 * 60))
+REFERENCE_CACHE_MAX_AGE = int(os.getenv('REFERENCE_CACHE_MAX_AGE', 0))
+
+# Кэш токенов авторизации: LRU в процессе и, по желанию, общий кэш
+# (CACHES['default']), через который отзыв токена виден всем процессам
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', 5 * 60))
+TOKEN_CACHE_SHARED = os.getenv('TOKEN_CACHE_SHARED', 'False') == 'True'
+
+# Сколько рецептов можно добавить или убрать одним пакетным запросом
+# к избранному и списку покупок
+RECIPE_BATCH_MAX_SIZE = int(os.getenv('RECIPE_BATCH_MAX_SIZE', 100))
+
+# Лента подписок: рецепты автора копируются в ленты подписчиков пачками,
+# если подписчиков не больше FEED_FANOUT_MAX_FOLLOWERS; иначе ленты
+# читают его рецепты при запросе
+FEED_FANOUT_MAX_FOLLOWERS = int(os.getenv('FEED_FANOUT_MAX_FOLLOWERS', 5000))
+FEED_FANOUT_BATCH_SIZE = int(os.getenv('FEED_FANOUT_BATCH_SIZE', 1000))
+# Сколько последних рецептов автора попадает в ленту при подписке
+FEED_FOLLOW_BACKFILL = int(os.getenv('FEED_FOLLOW_BACKFILL', 50))
+
+# Конфигурация полнотекстового поиска PostgreSQL (to_tsvector)
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'russian')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -131,6 +219,19 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Images
+IMAGE_MAX_UPLOAD_SIZE = int(
+    os.getenv('IMAGE_MAX_UPLOAD_SIZE', 10 * 1024 * 1024)
+)
+IMAGE_MAX_DIMENSION = int(os.getenv('IMAGE_MAX_DIMENSION', 8000))
+IMAGE_RENDITION_QUALITY = int(os.getenv('IMAGE_RENDITION_QUALITY', 80))
+IMAGE_RENDITION_WORKERS = int(os.getenv('IMAGE_RENDITION_WORKERS', 2))
+
+# wsgi или asgi, задаётся Dockerfile. Под ASGI маршруты API асинхронные,
+# безопасные запросы идут в ASYNC_READ_WORKERS потоках (api.async_views)
+SERVER_INTERFACE = os.getenv('SERVER_INTERFACE', 'wsgi')
+ASYNC_READ_WORKERS = int(os.getenv('ASYNC_READ_WORKERS', 8))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -142,7 +243,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 }
 
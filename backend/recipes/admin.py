@@ -22,14 +22,13 @@ class RecipeAdmin(admin.ModelAdmin):
     """Модель рецепта в админке"""
     list_display = ('author', 'name', 'favorites_count')
     list_filter = ('author', 'name', 'tags')
+    list_select_related = ('author',)
+    readonly_fields = ('favorites_count', 'in_cart_count')
     inlines = [
         Ingredientline,
         Tagline
     ]
 
-    def favorites_count(self, obj):
-        return obj.recipe_favorite.count()
-
 
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Tag)
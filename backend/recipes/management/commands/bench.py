@@ -0,0 +1,441 @@
+import json
+import random
+import statistics
+import tempfile
+import time
+from io import StringIO
+
+from api.recipe_reader import read_recipes, recipe_rows
+from api.renderers import FastJSONRenderer
+from api.serializers import RecipeReadSerializer
+from api.tests.base import make_image
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, Subscribe, Tag, TagRecipe)
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from users.models import CustomUser
+
+PREFIX = 'bench'
+DISHES = ('суп', 'салат', 'пирог', 'каша', 'рагу', 'паста', 'запеканка',
+          'омлет', 'плов', 'блины')
+PERCENTILES = (50, 90, 99)
+# Из-за внешней транзакции atomic во вьюхах превращается в точки
+# сохранения; в боевом запросе их нет, поэтому они не считаются
+SAVEPOINT_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT',
+                        'ROLLBACK TO SAVEPOINT')
+
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга"""
+    ordered = sorted(values)
+    rank = max(round(percent / 100 * len(ordered) + 0.5) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summary(timings, queries):
+    return {
+        'mean_ms': round(statistics.mean(timings), 2),
+        **{
+            f'p{percent}_ms': round(percentile(timings, percent), 2)
+            for percent in PERCENTILES
+        },
+        'queries': max(queries),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Наполняет базу синтетическими данными, замеряет основные '
+            'эндпоинты API и печатает перцентили задержек и число '
+            'SQL-запросов. Все данные создаются в транзакции, которая '
+            'в конце откатывается')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--recipes', type=int, default=500)
+        parser.add_argument('--tags', type=int, default=8)
+        parser.add_argument('--ingredients', type=int, default=300)
+        parser.add_argument(
+            '--popular-followers', type=int, default=10000,
+            help=('Сколько подписчиков у двух популярных авторов: с fan-out '
+                  'при публикации и без него'),
+        )
+        parser.add_argument(
+            '--iterations', type=int, default=20,
+            help='Сколько раз замерять каждый сценарий',
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=2,
+            help='Сколько первых прогонов не учитывать',
+        )
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--only', nargs='+', metavar='SCENARIO',
+            help='Замерить только перечисленные сценарии',
+        )
+        parser.add_argument(
+            '--serialize-count', type=int, default=100,
+            help=('Сколько рецептов сериализовать при замере пропускной '
+                  'способности чтения (0 — не замерять)'),
+        )
+        parser.add_argument(
+            '--json', metavar='PATH',
+            help='Записать результаты в JSON (- для stdout)',
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        # Загруженные изображения пишутся во временный MEDIA_ROOT:
+        # транзакция откатывается, а файлы остались бы
+        with tempfile.TemporaryDirectory() as media, \
+                transaction.atomic(), \
+                override_settings(ALLOWED_HOSTS=['testserver'],
+                                  MEDIA_ROOT=media):
+            started = time.perf_counter()
+            self.seed(options)
+            self.stderr.write('Данные созданы за {:.1f} с'.format(
+                time.perf_counter() - started))
+            results = self.run_scenarios(options)
+            if options['serialize_count']:
+                results.update(self.run_serializers(options))
+            transaction.set_rollback(True)
+        report = {
+            'vendor': connection.vendor,
+            'dataset': {
+                key: options[key]
+                for key in ('users', 'recipes', 'tags', 'ingredients',
+                            'popular_followers', 'seed')
+            },
+            'iterations': options['iterations'],
+            'results': results,
+        }
+        self.print_table(
+            results, self.stderr if options['json'] == '-' else self.stdout)
+        if options['json'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        elif options['json']:
+            with open(options['json'], 'w') as file:
+                json.dump(report, file, indent=2)
+
+    def seed(self, options):
+        rnd = self.random
+        password = make_password(None)
+        CustomUser.objects.bulk_create(
+            CustomUser(
+                email=f'{PREFIX}{i}@example.com',
+                username=f'{PREFIX}_user_{i}',
+                first_name='Бенч',
+                last_name=str(i),
+                password=password,
+            )
+            for i in range(options['users'])
+        )
+        users = list(CustomUser.objects.filter(
+            username__startswith=f'{PREFIX}_user_'))
+        self.tokens = {
+            token.user_id: token.key
+            for token in Token.objects.bulk_create(
+                Token(key=Token.generate_key(), user=user) for user in users
+            )
+        }
+        colors = set(Tag.objects.values_list('color', flat=True))
+        tags = []
+        for i in range(options['tags']):
+            color = '#{:06x}'.format(rnd.randrange(1 << 24))
+            while color in colors:
+                color = '#{:06x}'.format(rnd.randrange(1 << 24))
+            colors.add(color)
+            tags.append(Tag(
+                name=f'{PREFIX} {i}', slug=f'{PREFIX}-{i}', color=color))
+        Tag.objects.bulk_create(tags)
+        self.tag_slugs = [tag.slug for tag in tags]
+        tag_ids = list(Tag.objects.filter(
+            slug__in=self.tag_slugs).values_list('id', flat=True))
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'{PREFIX} ингредиент {i}', measurement_unit='г')
+            for i in range(options['ingredients'])
+        )
+        self.ingredient_ids = list(Ingredient.objects.filter(
+            name__startswith=f'{PREFIX} ').values_list('id', flat=True))
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=rnd.choice(users),
+                name=f'{PREFIX} {rnd.choice(DISHES)} {i}',
+                text='Синтетический рецепт для замеров',
+                cooking_time=rnd.randint(5, 180),
+                image='recipes/images/bench.png',
+            )
+            for i in range(options['recipes'])
+        )
+        recipe_ids = list(Recipe.objects.filter(
+            name__startswith=f'{PREFIX} ').values_list('id', flat=True))
+        TagRecipe.objects.bulk_create(
+            TagRecipe(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in rnd.sample(tag_ids, min(rnd.randint(1, 3),
+                                                  len(tag_ids)))
+        )
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=rnd.randint(1, 500),
+            )
+            for recipe_id in recipe_ids
+            for ingredient_id in rnd.sample(
+                self.ingredient_ids,
+                min(rnd.randint(3, 15), len(self.ingredient_ids))
+            )
+        )
+        for model, limit in ((Favorite, 20), (ShoppingCart, 10)):
+            model.objects.bulk_create(
+                model(user=user, recipe_id=recipe_id)
+                for user in users
+                for recipe_id in rnd.sample(
+                    recipe_ids, min(rnd.randint(0, limit), len(recipe_ids)))
+            )
+        Subscribe.objects.bulk_create(
+            Subscribe(user=user, following=author)
+            for user in users
+            for author in rnd.sample(users, min(rnd.randint(0, 10),
+                                                len(users)))
+            if author != user
+        )
+        self.seed_popular_authors(users, password, options)
+        call_command('recount', stdout=StringIO())
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+        call_command('rebuild_search_index', stdout=StringIO())
+        call_command('rebuild_feeds', stdout=StringIO())
+        self.users = users
+        self.recipe_ids = recipe_ids
+
+    def seed_popular_authors(self, users, password, options):
+        """Два автора с --popular-followers подписчиков: на первого
+        подписано не больше FEED_FANOUT_MAX_FOLLOWERS человек, и его
+        рецепты расходятся по лентам при публикации; второй читается
+        лентами при запросе. Остальные пользователи подписаны на обоих"""
+        self.fanout_author, self.popular_author = users[:2]
+        CustomUser.objects.bulk_create(
+            (
+                CustomUser(
+                    email=f'{PREFIX}.follower{i}@example.com',
+                    username=f'{PREFIX}_follower_{i}',
+                    first_name='Бенч',
+                    last_name=str(i),
+                    password=password,
+                )
+                for i in range(options['popular_followers'])
+            ),
+            batch_size=1000,
+        )
+        followers = [
+            user.id for user in users
+        ] + list(CustomUser.objects.filter(
+            username__startswith=f'{PREFIX}_follower_'
+        ).values_list('id', flat=True))
+        Subscribe.objects.bulk_create(
+            (
+                Subscribe(user_id=user_id, following=author)
+                for author, limit in (
+                    (self.fanout_author, settings.FEED_FANOUT_MAX_FOLLOWERS),
+                    (self.popular_author, None),
+                )
+                for user_id in followers[:limit]
+                if user_id != author.id
+            ),
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    def scenarios(self):
+        rnd = self.random
+        reader = max(self.users, key=lambda user: Recipe.objects.filter(
+            author=user).count())
+        image = make_image('orange', (64, 48))
+        own_recipe = Recipe.objects.filter(
+            author=reader).values_list('id', flat=True).first()
+        slugs = self.tag_slugs[:2]
+        middle_page = max(len(self.recipe_ids) // 6 // 2, 1)
+
+        def recipe_body():
+            return {
+                'name': f'{PREFIX} новый рецепт',
+                'text': 'Синтетический рецепт для замеров',
+                'cooking_time': rnd.randint(5, 180),
+                'image': image,
+                'tags': list(Tag.objects.filter(
+                    slug__in=slugs).values_list('id', flat=True)),
+                'ingredients': [
+                    {'id': ingredient_id, 'amount': rnd.randint(1, 500)}
+                    for ingredient_id in rnd.sample(self.ingredient_ids, 10)
+                ],
+            }
+
+        def batch_body(model, size):
+            """Каждый прогон добавляет size рецептов, которых ещё нет
+            у читателя: перед замером они убираются"""
+            def body():
+                recipe_ids = rnd.sample(self.recipe_ids, size)
+                model.remove_many(reader, recipe_ids)
+                return {'recipes': recipe_ids}
+            return body
+
+        recipe_id = self.recipe_ids[len(self.recipe_ids) // 2]
+
+        def single_cart_body():
+            ShoppingCart.remove_many(reader, [recipe_id])
+            return {}
+
+        return [
+            ('recipes_list_anonymous', None, 'get', '/api/recipes/', None),
+            ('recipes_list', reader, 'get', '/api/recipes/', None),
+            ('recipes_list_tags', reader, 'get',
+             '/api/recipes/?' + '&'.join(f'tags={slug}' for slug in slugs),
+             None),
+            ('recipes_list_author', reader, 'get',
+             f'/api/recipes/?author={self.users[1].id}', None),
+            ('recipes_list_favorited', reader, 'get',
+             '/api/recipes/?is_favorited=1', None),
+            ('recipes_list_in_cart', reader, 'get',
+             '/api/recipes/?is_in_shopping_cart=1', None),
+            ('recipes_list_deep_page', reader, 'get',
+             f'/api/recipes/?page={middle_page}', None),
+            ('recipes_list_cursor', reader, 'get',
+             '/api/recipes/?cursor=', None),
+            ('recipes_search', reader, 'get',
+             '/api/recipes/?search=пирог', None),
+            ('recipes_search_ingredient', reader, 'get',
+             f'/api/recipes/?search=пирог%20{PREFIX}%20ингредиент%2042',
+             None),
+            ('recipe_retrieve', reader, 'get',
+             f'/api/recipes/{recipe_id}/', None),
+            ('download_shopping_cart', reader, 'get',
+             '/api/recipes/download_shopping_cart/', None),
+            ('subscriptions', reader, 'get',
+             '/api/users/subscriptions/?recipes_limit=3', None),
+            ('ingredient_search', reader, 'get',
+             f'/api/ingredients/?name={PREFIX}%20ингредиент%201', None),
+            ('recipes_feed', reader, 'get', '/api/recipes/feed/', None),
+            ('recipes_feed_deep', reader, 'get',
+             f'/api/recipes/feed/?before={recipe_id}', None),
+            ('recipe_create', reader, 'post', '/api/recipes/', recipe_body),
+            ('recipe_create_fanout', self.fanout_author, 'post',
+             '/api/recipes/', recipe_body),
+            ('recipe_create_popular', self.popular_author, 'post',
+             '/api/recipes/', recipe_body),
+            ('shopping_cart_single', reader, 'post',
+             f'/api/recipes/{recipe_id}/shopping_cart/', single_cart_body),
+            ('shopping_cart_batch_1', reader, 'post',
+             '/api/recipes/shopping_cart/', batch_body(ShoppingCart, 1)),
+            ('shopping_cart_batch_50', reader, 'post',
+             '/api/recipes/shopping_cart/', batch_body(ShoppingCart, 50)),
+            ('favorite_batch_50', reader, 'post',
+             '/api/recipes/favorite/', batch_body(Favorite, 50)),
+            ('recipe_update', reader, 'patch',
+             f'/api/recipes/{own_recipe}/', recipe_body),
+        ]
+
+    def run_scenarios(self, options):
+        results = {}
+        clients = {}
+        for name, user, method, path, body in self.scenarios():
+            if options['only'] and name not in options['only']:
+                continue
+            if user not in clients:
+                client = Client()
+                if user is not None:
+                    client.defaults['HTTP_AUTHORIZATION'] = (
+                        'Token ' + self.tokens[user.id])
+                clients[user] = client
+            client = clients[user]
+            timings, queries = [], []
+            for iteration in range(options['warmup'] + options['iterations']):
+                kwargs = {}
+                if body is not None:
+                    kwargs = {
+                        'data': json.dumps(body()),
+                        'content_type': 'application/json',
+                    }
+                with CaptureQueriesContext(connection) as context:
+                    started = time.perf_counter()
+                    response = getattr(client, method)(path, **kwargs)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    elapsed = time.perf_counter() - started
+                if response.status_code >= 400:
+                    raise RuntimeError(
+                        f'{name}: {response.status_code} {response.content}')
+                if iteration >= options['warmup']:
+                    timings.append(elapsed * 1000)
+                    queries.append(sum(
+                        not query['sql'].startswith(SAVEPOINT_STATEMENTS)
+                        for query in context.captured_queries
+                    ))
+            results[name] = {
+                'path': path,
+                'method': method.upper(),
+                **summary(timings, queries),
+            }
+        return results
+
+    def run_serializers(self, options):
+        """Пропускная способность чтения рецептов: RecipeReadSerializer
+        с JSONRenderer против recipe_reader с FastJSONRenderer"""
+        user = self.users[0]
+        request = Request(RequestFactory().get('/api/recipes/'))
+        request.user = user
+        count = options['serialize_count']
+        paths = {
+            'serialize_drf': lambda: JSONRenderer().render(
+                RecipeReadSerializer(
+                    Recipe.objects.for_read(user).order_by('-id')[:count],
+                    many=True, context={'request': request}
+                ).data
+            ),
+            'serialize_fast': lambda: FastJSONRenderer().render(read_recipes(
+                recipe_rows(
+                    Recipe.objects.with_user_flags(user).order_by('-id')[
+                        :count]
+                ),
+                request
+            )),
+        }
+        outputs = {name: render() for name, render in paths.items()}
+        if len(set(outputs.values())) != 1:
+            raise CommandError(
+                'Быстрое чтение рецептов расходится с RecipeReadSerializer')
+        results = {}
+        for name, render in paths.items():
+            timings, queries = [], []
+            for iteration in range(options['warmup'] + options['iterations']):
+                with CaptureQueriesContext(connection) as context:
+                    started = time.perf_counter()
+                    render()
+                    elapsed = time.perf_counter() - started
+                if iteration >= options['warmup']:
+                    timings.append(elapsed * 1000)
+                    queries.append(len(context))
+            results[name] = {
+                'recipes': count,
+                'recipes_per_sec': round(
+                    count / statistics.median(timings) * 1000),
+                **summary(timings, queries),
+            }
+        return results
+
+    def print_table(self, results, out):
+        out.write('{:<28}{:>10}{:>10}{:>10}{:>10}{:>9}'.format(
+            'сценарий', 'mean', 'p50', 'p90', 'p99', 'queries'))
+        for name, result in results.items():
+            if 'recipes_per_sec' in result:
+                name = '{} ({}/с)'.format(name, result['recipes_per_sec'])
+            out.write('{:<28}{:>10}{:>10}{:>10}{:>10}{:>9}'.format(
+                name, result['mean_ms'], result['p50_ms'], result['p90_ms'],
+                result['p99_ms'], result['queries']))
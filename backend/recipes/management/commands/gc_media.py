@@ -0,0 +1,79 @@
+import posixpath
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from recipes.models import Recipe
+from recipes.renditions import RENDITIONS_DIR
+from recipes.storage import recipe_image_storage
+
+IMAGES_DIR = Recipe._meta.get_field('image').upload_to
+
+
+def stem_of(name):
+    return posixpath.splitext(posixpath.basename(name))[0]
+
+
+class Command(BaseCommand):
+    help = ('Удаляет изображения рецептов, на которые не ссылается '
+            'ни один рецепт, вместе с их уменьшенными копиями')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько файлов удалять за один проход',
+        )
+        parser.add_argument(
+            '--grace', type=int, default=3600,
+            help=('Не трогать файлы моложе стольких секунд: рецепт с ними '
+                  'может ещё не быть сохранён'),
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено',
+        )
+
+    def handle(self, *args, **options):
+        storage = recipe_image_storage
+        references = {
+            row['image']: row['refs']
+            for row in Recipe.objects.order_by().values('image').annotate(
+                refs=Count('pk')
+            )
+        }
+        deadline = time.time() - options['grace']
+        blobs = []
+        if storage.exists(IMAGES_DIR):
+            blobs = [
+                IMAGES_DIR + filename
+                for filename in storage.listdir(IMAGES_DIR)[1]
+            ]
+        garbage = [
+            name for name in blobs
+            if not references.get(name)
+            and storage.get_modified_time(name).timestamp() < deadline
+        ]
+        alive = {stem_of(name) for name in blobs} - {
+            stem_of(name) for name in garbage
+        }
+        orphans = []
+        if storage.exists(RENDITIONS_DIR):
+            orphans = [
+                RENDITIONS_DIR + filename
+                for filename in storage.listdir(RENDITIONS_DIR)[1]
+                if filename.rsplit('_', 1)[0] not in alive
+            ]
+        victims = garbage + orphans
+        for start in range(0, len(victims), options['batch_size']):
+            batch = victims[start:start + options['batch_size']]
+            for name in batch:
+                if options['dry_run']:
+                    self.stdout.write(name)
+                else:
+                    storage.delete(name)
+        self.stdout.write(
+            f'Ссылок: {sum(references.values())}, файлов: {len(blobs)}, '
+            f'удалено изображений: {len(garbage)}, '
+            f'уменьшенных копий: {len(orphans)}'
+            + (' (пробный запуск)' if options['dry_run'] else '')
+        )
@@ -1,27 +1,105 @@
 import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
 
+from api.cache import bump_version
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from recipes.models import Ingredient
 
 PATH_TO_UPLOAD = f'{settings.BASE_DIR}/data/'
+DEFAULT_BATCH_SIZE = 1000
+
+
+def read_csv(file):
+    for line_number, row in enumerate(csv.reader(file), start=1):
+        if len(row) != 2:
+            raise CommandError(
+                f'{file.name}:{line_number}: ожидалось 2 колонки'
+            )
+        yield row[0].strip(), row[1].strip()
+
+
+def read_json(file):
+    for item in json.load(file):
+        yield item['name'].strip(), item['measurement_unit'].strip()
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
 
 
 class Command(BaseCommand):
-    help = 'Наполняет БД из csv'
+    help = 'Наполняет БД ингредиентами из csv или json'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            nargs='*',
+            default=[PATH_TO_UPLOAD + 'ingredients.csv'],
+            help='Файлы .csv (name,unit) или .json со списком объектов'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Размер пачки для bulk_create'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля')
+        existing = set(
+            Ingredient.objects.values_list('name', 'measurement_unit')
+        )
+        for path in options['paths']:
+            self.load(Path(path), existing, options)
+        bump_version('ingredients')
 
-    def handle(self, *args, **kwargs):
+    def load(self, path, existing, options):
+        reader = READERS.get(path.suffix)
+        if reader is None:
+            raise CommandError(f'Неподдерживаемый формат файла: {path}')
+        batch_size = options['batch_size']
+        rows = created = 0
+        started = time.perf_counter()
         try:
-            with open(
-                (PATH_TO_UPLOAD + 'ingredients.csv'),
-                encoding='utf8'
-            ) as file:
-                reader = csv.reader(file)
-                for row in reader:
-                    Ingredient.objects.get_or_create(
-                        name=row[0],
-                        measurement_unit=row[1]
+            with open(path, encoding='utf8') as file, transaction.atomic():
+                pairs = reader(file)
+                while True:
+                    chunk = list(islice(pairs, batch_size))
+                    if not chunk:
+                        break
+                    rows += len(chunk)
+                    ingredients = []
+                    for pair in chunk:
+                        if pair in existing:
+                            continue
+                        existing.add(pair)
+                        ingredients.append(Ingredient(
+                            name=pair[0],
+                            measurement_unit=pair[1]
+                        ))
+                    Ingredient.objects.bulk_create(
+                        ingredients,
+                        batch_size=batch_size,
+                        ignore_conflicts=True
                     )
-                print('ingredients.csv успешно загружено')
-        except Exception:
-            print('Сбой загрузки ingredients.csv')
+                    created += len(ingredients)
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'{path.name}: {rows} строк')
+        except OSError as error:
+            raise CommandError(f'Сбой загрузки {path}: {error}')
+        except (KeyError, TypeError, AttributeError, ValueError) as error:
+            raise CommandError(f'Некорректные данные в {path}: {error!r}')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{path.name} успешно загружено: {rows} строк, '
+            f'добавлено {created}, '
+            f'{rows / elapsed if elapsed else rows:.0f} строк/с'
+        ))
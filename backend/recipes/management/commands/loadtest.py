@@ -0,0 +1,90 @@
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPSConnection
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from .bench import PERCENTILES, percentile
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест запущенного сервера: параллельные GET-запросы '
+            'к списку URL, пропускная способность и перцентили задержек. '
+            'Запустите его против WSGI- и ASGI-развёртывания и сравните')
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', metavar='URL')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument(
+            '--token', help='Токен для заголовка Authorization')
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument(
+            '--json', metavar='PATH',
+            help='Записать результаты в JSON (- для stdout)',
+        )
+
+    def handle(self, *args, **options):
+        targets = [urlsplit(url) for url in options['urls']]
+        if any(target.scheme not in ('http', 'https') for target in targets):
+            raise CommandError('Нужны URL вида http://host:port/path')
+        headers = {'Accept': 'application/json'}
+        if options['token']:
+            headers['Authorization'] = 'Token ' + options['token']
+        local = threading.local()
+
+        def fetch(number):
+            target = targets[number % len(targets)]
+            connections = getattr(local, 'connections', None)
+            if connections is None:
+                connections = local.connections = {}
+            connection = connections.get(target.netloc)
+            if connection is None:
+                connection_class = (HTTPSConnection if target.scheme == 'https'
+                                    else HTTPConnection)
+                connection = connections[target.netloc] = connection_class(
+                    target.netloc, timeout=options['timeout'])
+            path = target.path + ('?' + target.query if target.query else '')
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, ValueError):
+                connection.close()
+                connections.pop(target.netloc)
+                status = None
+            return status, (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            results = list(pool.map(fetch, range(options['requests'])))
+        elapsed = time.perf_counter() - started
+        timings = [timing for status, timing in results if status == 200]
+        report = {
+            'urls': options['urls'],
+            'concurrency': options['concurrency'],
+            'requests': options['requests'],
+            'errors': len(results) - len(timings),
+            'seconds': round(elapsed, 2),
+            'requests_per_sec': round(len(timings) / elapsed, 1),
+        }
+        if timings:
+            report['mean_ms'] = round(statistics.mean(timings), 2)
+            report.update(
+                (f'p{percent}_ms', round(percentile(timings, percent), 2))
+                for percent in PERCENTILES
+            )
+        if options['json'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        if options['json']:
+            with open(options['json'], 'w') as file:
+                json.dump(report, file, indent=2)
+        for key, value in report.items():
+            self.stdout.write(f'{key}: {value}')
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from recipes.models import FeedEntry, Recipe, Subscribe
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает ленты подписок: заново решает, какие рецепты '
+            'расходятся по лентам (по текущему FEED_FANOUT_MAX_FOLLOWERS), '
+            'и копирует их в ленты подписчиков авторов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        fanned_out = Q(
+            author__followers_count__lte=settings.FEED_FANOUT_MAX_FOLLOWERS)
+        pairs = Subscribe.objects.filter(
+            following__recipes__fanned_out=True,
+        ).values_list('user_id', 'following__recipes__id')
+        with transaction.atomic():
+            Recipe.objects.filter(fanned_out).update(fanned_out=True)
+            Recipe.objects.exclude(fanned_out).update(fanned_out=False)
+            FeedEntry.objects.all().delete()
+            entries = FeedEntry.objects.bulk_create(
+                (
+                    FeedEntry(user_id=user_id, recipe_id=recipe_id)
+                    for user_id, recipe_id in pairs.iterator()
+                ),
+                batch_size=options['batch_size'],
+            )
+        self.stdout.write(f'Записей в лентах: {len(entries)}')
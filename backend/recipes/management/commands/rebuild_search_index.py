@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from recipes.models import Recipe
+from recipes.search import create_search_index, index_recipes
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает поисковый индекс рецептов (tsvector в PostgreSQL, '
+            'FTS5 в SQLite) пачками по диапазонам id')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        create_search_index(connection)
+        bounds = Recipe.objects.aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            self.stdout.write('Рецептов нет')
+            return
+        started = time.perf_counter()
+        batch_size = options['batch_size']
+        for first_id in range(bounds['first'], bounds['last'] + 1,
+                              batch_size):
+            with transaction.atomic():
+                index_recipes(first_id, first_id + batch_size - 1)
+        self.stdout.write('Индекс пересобран за {:.1f} с'.format(
+            time.perf_counter() - started))
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Sum
+from recipes.models import IngredientRecipe, ShoppingListItem
+
+
+def expected_totals():
+    """Списки покупок, посчитанные заново по корзинам"""
+    return {
+        (row['cart_user'], row['ingredient']): row['sum']
+        for row in IngredientRecipe.objects.filter(
+            recipe__recipe_in_cart__isnull=False
+        ).values(
+            'ingredient', cart_user=F('recipe__recipe_in_cart__user')
+        ).annotate(sum=Sum('amount')).order_by().iterator()
+    }
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает готовые списки покупок по корзинам; '
+            'с --check только сверяет их')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Сверить и завершиться с ошибкой при расхождениях',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            expected = expected_totals()
+            stored = {
+                (user_id, ingredient_id): total
+                for user_id, ingredient_id, total in
+                ShoppingListItem.objects.values_list(
+                    'user_id', 'ingredient_id', 'total'
+                ).iterator()
+            }
+            drifted = {
+                key for key in expected.keys() | stored.keys()
+                if expected.get(key) != stored.get(key)
+            }
+            if options['check']:
+                for user_id, ingredient_id in sorted(drifted)[:20]:
+                    self.stdout.write(
+                        f'user={user_id} ingredient={ingredient_id}: '
+                        f'ожидается {expected.get((user_id, ingredient_id))}'
+                        f', в списке {stored.get((user_id, ingredient_id))}'
+                    )
+                if drifted:
+                    raise CommandError(f'Расхождений: {len(drifted)}')
+                self.stdout.write(f'Строк: {len(stored)}, расхождений нет')
+                return
+            users = {user_id for user_id, _ in drifted}
+            ShoppingListItem.objects.filter(user_id__in=users).delete()
+            ShoppingListItem.objects.bulk_create(
+                (
+                    ShoppingListItem(
+                        user_id=user_id, ingredient_id=ingredient_id,
+                        total=total
+                    )
+                    for (user_id, ingredient_id), total in expected.items()
+                    if user_id in users
+                ),
+                batch_size=options['batch_size'],
+            )
+        self.stdout.write(
+            f'Пересобраны списки пользователей: {len(users)}, '
+            f'исправлено строк: {len(drifted)}'
+        )
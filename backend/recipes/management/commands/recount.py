@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from recipes.models import Favorite, Recipe, ShoppingCart, Subscribe
+from users.models import CustomUser
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_cart_count', ShoppingCart, 'recipe'),
+    (CustomUser, 'recipes_count', Recipe, 'author'),
+    (CustomUser, 'followers_count', Subscribe, 'following'),
+)
+
+
+def count_of(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field
+        ).annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики рецептов и пользователей, '
+            'если они разошлись с данными (например, после удаления '
+            'из админки)')
+
+    def handle(self, *args, **options):
+        for model, counter, source, field in COUNTERS:
+            with transaction.atomic():
+                drifted = model.objects.annotate(
+                    actual=count_of(source, field)
+                ).filter(~Q(**{counter: F('actual')})).values('pk')
+                updated = model.objects.filter(
+                    pk__in=Subquery(drifted)
+                ).update(**{counter: count_of(source, field)})
+            self.stdout.write(
+                f'{model.__name__}.{counter}: исправлено {updated}'
+            )
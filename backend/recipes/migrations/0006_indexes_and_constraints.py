@@ -0,0 +1,81 @@
+# Generated by Django 3.2.3 on 2026-10-18 04:03
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def duplicates(model, fields, **aggregates):
+    """Группы строк с одинаковыми fields и id строки, которая остаётся"""
+    return model.objects.values(*fields).annotate(
+        keep=Min('id'), count=Count('id'), **aggregates
+    ).filter(count__gt=1).order_by()
+
+
+def remove_duplicates(model_name, fields):
+    """Удаляет повторы связей, оставляя первую"""
+
+    def remove(apps, schema_editor):
+        model = apps.get_model('recipes', model_name)
+        for group in duplicates(model, fields):
+            model.objects.filter(
+                **{field: group[field] for field in fields}
+            ).exclude(pk=group['keep']).delete()
+
+    return remove
+
+
+def merge_ingredient_duplicates(apps, schema_editor):
+    """Повторы ингредиента в рецепте сливаются в одну строку
+    с суммой количеств"""
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    for group in duplicates(
+        IngredientRecipe, ('recipe', 'ingredient'), amount=Sum('amount')
+    ):
+        rows = IngredientRecipe.objects.filter(
+            recipe=group['recipe'], ingredient=group['ingredient'])
+        rows.filter(pk=group['keep']).update(amount=group['amount'])
+        rows.exclude(pk=group['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_auto_20230820_1800'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-id'], name='recipe_author_id_idx'),
+        ),
+        migrations.RunPython(
+            remove_duplicates('Favorite', ('user', 'recipe')),
+            migrations.RunPython.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_user_favorite'),
+        ),
+        migrations.RunPython(
+            merge_ingredient_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredientrecipe',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_recipe_ingredient'),
+        ),
+        migrations.RunPython(
+            remove_duplicates('ShoppingCart', ('user', 'recipe')),
+            migrations.RunPython.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_user_shopping_cart'),
+        ),
+        migrations.RunPython(
+            remove_duplicates('TagRecipe', ('recipe', 'tag')),
+            migrations.RunPython.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='tagrecipe',
+            constraint=models.UniqueConstraint(fields=('recipe', 'tag'), name='unique_recipe_tag'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.2.3 on 2026-10-18 04:05
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Повторы ингредиента сливаются в первый: строки рецептов
+    переносятся на него, количества в одном рецепте складываются"""
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    groups = Ingredient.objects.values('name', 'measurement_unit').annotate(
+        keep=Min('id'), count=Count('id')
+    ).filter(count__gt=1).order_by()
+    for group in groups:
+        extra = Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(pk=group['keep'])
+        for row in IngredientRecipe.objects.filter(
+            ingredient__in=extra
+        ).order_by('id'):
+            target = IngredientRecipe.objects.filter(
+                recipe_id=row.recipe_id, ingredient_id=group['keep']
+            ).first()
+            if target is None:
+                row.ingredient_id = group['keep']
+                row.save(update_fields=['ingredient'])
+            else:
+                target.amount += row.amount
+                target.save(update_fields=['amount'])
+                row.delete()
+        extra.delete()
+    # Отложенные проверки внешних ключей PostgreSQL выполняются сейчас,
+    # иначе ALTER TABLE ниже упадёт на pending trigger events
+    schema_editor.connection.check_constraints()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_indexes_and_constraints'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient_unit'),
+        ),
+    ]
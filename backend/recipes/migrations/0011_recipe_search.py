@@ -0,0 +1,35 @@
+# Generated by Django 3.2.3 on 2026-10-18 04:26
+
+from django.db import migrations
+from django.db.models import Max
+import recipes.search
+
+
+def build_search_index(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    connection = schema_editor.connection
+    recipes.search.create_search_index(connection)
+    last_id = Recipe.objects.using(connection.alias).aggregate(
+        last_id=Max('id'))['last_id']
+    if last_id is not None:
+        recipes.search.index_recipes(0, last_id, using=connection.alias)
+
+
+def drop_search_index(apps, schema_editor):
+    recipes.search.drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_shopping_list_items'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=recipes.search.TSVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(build_search_index, drop_search_index),
+    ]
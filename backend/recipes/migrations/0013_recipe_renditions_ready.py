@@ -0,0 +1,39 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:01
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+from recipes.renditions import RENDITIONS, rendition_name
+
+
+def mark_ready(apps, schema_editor):
+    """Отмечает рецепты, копии изображений которых уже сделаны"""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    images = Recipe.objects.exclude(image='').values_list(
+        'image', flat=True).distinct()
+    ready = [
+        image for image in images.iterator()
+        if all(
+            default_storage.exists(rendition_name(image, rendition))
+            for rendition in RENDITIONS
+        )
+    ]
+    for start in range(0, len(ready), 500):
+        Recipe.objects.filter(
+            image__in=ready[start:start + 500]
+        ).update(renditions_ready=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_feed_entry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='renditions_ready',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_ready, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.3 on 2026-10-18 06:12
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def mark_fanned_out(apps, schema_editor):
+    """Отмечает рецепты, которые уже есть в лентах всех подписчиков
+    автора. Остальные, в том числе опубликованные, пока у автора было
+    больше FEED_FANOUT_MAX_FOLLOWERS подписчиков, лента добавит
+    при чтении"""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Subscribe = apps.get_model('recipes', 'Subscribe')
+    FeedEntry = apps.get_model('recipes', 'FeedEntry')
+    missing = Subscribe.objects.filter(
+        following_id=OuterRef('author_id'),
+    ).filter(~Exists(FeedEntry.objects.filter(
+        user_id=OuterRef('user_id'),
+        recipe_id=OuterRef(OuterRef('pk')),
+    )))
+    Recipe.objects.filter(~Exists(missing)).update(fanned_out=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_recipe_renditions_ready'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='fanned_out',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_fanned_out, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('fanned_out', False)), fields=['author', '-id'], name='recipe_pulled_idx'),
+        ),
+    ]
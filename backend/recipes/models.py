@@ -1,7 +1,19 @@
+from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import connections, models, router
+from django.db.models import (BooleanField, Exists, F, IntegerField, OuterRef,
+                              Prefetch, Subquery, Sum, Value)
+from django.db.models.expressions import RawSQL
 from users.models import CustomUser
 
+from .search import TSVectorField
+from .storage import recipe_image_storage
+
+
+def update_counter(queryset, field, delta):
+    """Атомарно меняет счётчик выражением F() без чтения строки"""
+    return queryset.update(**{field: F(field) + delta})
+
 
 class Ingredient(models.Model):
     """Модель ингредиента"""
@@ -14,6 +26,14 @@ class Ingredient(models.Model):
         verbose_name='Единица измерения'
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient_unit',
+            )
+        ]
+
 
 class Tag(models.Model):
     """Модель тега"""
@@ -32,6 +52,42 @@ class Tag(models.Model):
     )
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Набор запросов для модели Recipe"""
+
+    def with_user_flags(self, user):
+        """Добавляет флаги is_favorited и is_in_shopping_cart
+        для пользователя подзапросами EXISTS"""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField())
+            )
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')))
+        )
+
+    def for_read(self, user):
+        """План чтения рецептов: флаги пользователя, авторы,
+        теги и ингредиенты загружаются фиксированным числом запросов"""
+        return self.with_user_flags(user).prefetch_related(
+            Prefetch(
+                'author',
+                queryset=Subscribe.annotate_subscribed(
+                    CustomUser.objects.all(), user)
+            ),
+            Prefetch('tags', queryset=Tag.objects.order_by('id')),
+            Prefetch(
+                'ingredientrecipe_set',
+                queryset=IngredientRecipe.objects.select_related(
+                    'ingredient').order_by('id')
+            )
+        )
+
+
 class Recipe(models.Model):
     """Модель рецепта"""
     author = models.ForeignKey(
@@ -45,6 +101,7 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to='recipes/images/',
+        storage=recipe_image_storage,
     )
     text = models.TextField(
         verbose_name='Описание'
@@ -73,9 +130,71 @@ class Recipe(models.Model):
         ]
     )
 
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False
+    )
+    in_cart_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False
+    )
+    # Уменьшенные копии изображения готовы; ставит make_renditions
+    renditions_ready = models.BooleanField(
+        default=False,
+        editable=False
+    )
+    # Рецепт разошёлся по лентам подписчиков при публикации; иначе
+    # лента добавляет его при чтении. Решение не пересматривается при
+    # смене числа подписчиков, только rebuild_feeds
+    fanned_out = models.BooleanField(
+        default=False,
+        editable=False
+    )
+    # tsvector по названию, ингредиентам и описанию (только PostgreSQL,
+    # GIN-индекс создаёт миграция); в SQLite поиск идёт по таблице FTS5
+    search_vector = TSVectorField(
+        null=True,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['author', '-id'],
+                name='recipe_author_id_idx'
+            ),
+            models.Index(
+                fields=['-favorites_count', '-id'],
+                name='recipe_popular_idx'
+            ),
+            models.Index(
+                fields=['author', '-id'],
+                name='recipe_pulled_idx',
+                condition=models.Q(fanned_out=False)
+            )
+        ]
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        if adding:
+            self.fanned_out = FeedEntry.fans_out(self.author_id)
+        super().save(*args, **kwargs)
+        if adding:
+            update_counter(
+                CustomUser.objects.filter(pk=self.author_id),
+                'recipes_count',
+                1
+            )
+            if self.fanned_out:
+                FeedEntry.fan_out(self)
+
 
 class IngredientRecipe(models.Model):
     """Модель ингредиент-рецепт"""
@@ -100,6 +219,14 @@ class IngredientRecipe(models.Model):
         ]
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'ingredient'],
+                name='unique_recipe_ingredient',
+            )
+        ]
+
 
 class TagRecipe(models.Model):
     """Модель тег-рецепт"""
@@ -112,6 +239,14 @@ class TagRecipe(models.Model):
         on_delete=models.CASCADE
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'tag'],
+                name='unique_recipe_tag',
+            )
+        ]
+
 
 class Subscribe(models.Model):
     """Модель подписки на автора"""
@@ -134,6 +269,118 @@ class Subscribe(models.Model):
             )
         ]
 
+    @classmethod
+    def create(cls, user, following):
+        item = cls.objects.create(user=user, following=following)
+        update_counter(
+            CustomUser.objects.filter(pk=following.pk),
+            'followers_count',
+            1
+        )
+        FeedEntry.follow(user, following)
+        return item
+
+    @classmethod
+    def remove(cls, user, following):
+        deleted, _ = cls.objects.filter(
+            user=user, following=following).delete()
+        if deleted:
+            update_counter(
+                CustomUser.objects.filter(pk=following.pk),
+                'followers_count',
+                -1
+            )
+            FeedEntry.objects.filter(
+                user=user, recipe__author=following).delete()
+        return bool(deleted)
+
+    @classmethod
+    def annotate_subscribed(cls, queryset, user):
+        """Добавляет к авторам флаг subscribed для пользователя"""
+        if not user.is_authenticated:
+            return queryset.annotate(
+                subscribed=Value(False, output_field=BooleanField())
+            )
+        return queryset.annotate(
+            subscribed=Exists(cls.objects.filter(
+                user=user, following=OuterRef('pk')))
+        )
+
+    @classmethod
+    def authors_with_recipes(cls, queryset, recipes_limit=None):
+        """Предзагружает не более recipes_limit
+        последних рецептов каждого автора"""
+        recipes = Recipe.objects.only(
+            'id', 'name', 'image', 'cooking_time', 'author_id'
+        ).order_by('-id')
+        if recipes_limit:
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).order_by('-id').values('pk')[:recipes_limit]
+            ))
+        return queryset.prefetch_related(
+            Prefetch('recipes', queryset=recipes))
+
+
+# Пакетные изменения возвращают строки, которые действительно
+# записали: счётчики и список покупок меняются только по ним, и два
+# параллельных запроса не применят одну связь дважды
+LINK_SQL = (
+    'INSERT INTO {table} ({user}, {recipe}) '
+    'SELECT %s, {id} FROM {recipes} WHERE {id} IN ({ids}) '
+    'ON CONFLICT DO NOTHING RETURNING {recipe}'
+)
+UNLINK_SQL = (
+    'DELETE FROM {table} WHERE {user} = %s AND {recipe} IN ({ids}) '
+    'RETURNING {recipe}'
+)
+
+
+def returned_recipe_ids(model, sql, user, recipe_ids):
+    """Выполняет LINK_SQL или UNLINK_SQL для связей model и возвращает
+    id рецептов из RETURNING в порядке recipe_ids"""
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    sql = sql.format(
+        table=quote(model._meta.db_table),
+        user=quote(model._meta.get_field('user').column),
+        recipe=quote(model._meta.get_field('recipe').column),
+        recipes=quote(Recipe._meta.db_table),
+        id=quote(Recipe._meta.pk.column),
+        ids=', '.join(['%s'] * len(recipe_ids)),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user.pk, *recipe_ids])
+        returned = {row[0] for row in cursor.fetchall()}
+    return [recipe_id for recipe_id in recipe_ids if recipe_id in returned]
+
+
+def link_recipes(model, user, recipe_ids, counter):
+    """Связывает пользователя с рецептами одной вставкой и одним UPDATE
+    прибавляет счётчик counter рецептов. Возвращает id добавленных
+    рецептов и множество id найденных"""
+    if not recipe_ids:
+        return [], set()
+    added = returned_recipe_ids(model, LINK_SQL, user, recipe_ids)
+    if added:
+        update_counter(Recipe.objects.filter(pk__in=added), counter, 1)
+    found = set(added) | set(Recipe.objects.filter(
+        pk__in=set(recipe_ids) - set(added)
+    ).values_list('id', flat=True))
+    return added, found
+
+
+def unlink_recipes(model, user, recipe_ids, counter):
+    """Удаляет связи пользователя с рецептами одним DELETE и уменьшает
+    счётчик counter рецептов. Возвращает id удалённых"""
+    if not recipe_ids:
+        return []
+    removed = returned_recipe_ids(model, UNLINK_SQL, user, recipe_ids)
+    if removed:
+        update_counter(Recipe.objects.filter(pk__in=removed), counter, -1)
+    return removed
+
 
 class Favorite(models.Model):
     """Модель для избранных рецептов"""
@@ -148,14 +395,37 @@ class Favorite(models.Model):
         related_name='recipe_favorite',
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_user_favorite',
+            )
+        ]
+
     @classmethod
     def create(cls, user, recipe):
-        item = cls(user=user, recipe=recipe)
-        recipe.is_favorited = True
-        recipe.save()
-        item.save()
+        item = cls.objects.create(user=user, recipe=recipe)
+        update_counter(
+            Recipe.objects.filter(pk=recipe.pk), 'favorites_count', 1)
         return item
 
+    @classmethod
+    def remove(cls, user, recipe):
+        deleted, _ = cls.objects.filter(user=user, recipe=recipe).delete()
+        if deleted:
+            update_counter(
+                Recipe.objects.filter(pk=recipe.pk), 'favorites_count', -1)
+        return bool(deleted)
+
+    @classmethod
+    def add_many(cls, user, recipe_ids):
+        return link_recipes(cls, user, recipe_ids, 'favorites_count')
+
+    @classmethod
+    def remove_many(cls, user, recipe_ids):
+        return unlink_recipes(cls, user, recipe_ids, 'favorites_count')
+
 
 class ShoppingCart(models.Model):
     """Модель для списка покупок"""
@@ -170,10 +440,225 @@ class ShoppingCart(models.Model):
         related_name='recipe_in_cart',
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_user_shopping_cart',
+            )
+        ]
+
     @classmethod
     def create(cls, user, recipe):
-        item = cls(user=user, recipe=recipe)
-        recipe.is_in_shopping_cart = True
-        recipe.save()
-        item.save()
+        item = cls.objects.create(user=user, recipe=recipe)
+        update_counter(
+            Recipe.objects.filter(pk=recipe.pk), 'in_cart_count', 1)
+        ShoppingListItem.apply([user.pk], recipe_amounts(recipe))
         return item
+
+    @classmethod
+    def remove(cls, user, recipe):
+        deleted, _ = cls.objects.filter(user=user, recipe=recipe).delete()
+        if deleted:
+            update_counter(
+                Recipe.objects.filter(pk=recipe.pk), 'in_cart_count', -1)
+            ShoppingListItem.apply([user.pk], recipe_amounts(recipe, -1))
+        return bool(deleted)
+
+    @classmethod
+    def add_many(cls, user, recipe_ids):
+        added, found = link_recipes(cls, user, recipe_ids, 'in_cart_count')
+        ShoppingListItem.apply([user.pk], total_amounts(added))
+        return added, found
+
+    @classmethod
+    def remove_many(cls, user, recipe_ids):
+        removed = unlink_recipes(cls, user, recipe_ids, 'in_cart_count')
+        ShoppingListItem.apply([user.pk], total_amounts(removed, -1))
+        return removed
+
+
+def recipe_amounts(recipe, sign=1):
+    """Словарь {id ингредиента: количество} для рецепта"""
+    return {
+        ingredient_id: sign * amount
+        for ingredient_id, amount in IngredientRecipe.objects.filter(
+            recipe=recipe
+        ).values_list('ingredient_id', 'amount')
+    }
+
+
+def total_amounts(recipe_ids, sign=1):
+    """Словарь {id ингредиента: количество} суммарно по рецептам"""
+    if not recipe_ids:
+        return {}
+    return {
+        ingredient_id: sign * total
+        for ingredient_id, total in IngredientRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values('ingredient_id').annotate(
+            total=Sum('amount')
+        ).order_by().values_list('ingredient_id', 'total')
+    }
+
+
+class ShoppingListItem(models.Model):
+    """Готовый список покупок: сумма ингредиента по рецептам в корзине.
+
+    Обновляется приращениями при изменении корзины и ингредиентов
+    рецептов из неё; пересобрать и сверить — rebuild_shopping_lists.
+    """
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    total = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_user_shopping_list_item',
+            )
+        ]
+
+    @classmethod
+    def apply(cls, user_ids, deltas):
+        """Прибавляет deltas {id ингредиента: количество} к спискам
+        пользователей: одна вставка недостающих строк и один UPDATE"""
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta
+        }
+        if not user_ids or not deltas:
+            return
+        existing = set(cls.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=deltas
+        ).values_list('user_id', 'ingredient_id'))
+        missing = [
+            cls(user_id=user_id, ingredient_id=ingredient_id, total=0)
+            for user_id in user_ids
+            for ingredient_id in deltas
+            if (user_id, ingredient_id) not in existing
+        ]
+        if missing:
+            cls.objects.bulk_create(missing, ignore_conflicts=True)
+        items = cls.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=deltas)
+        # Case из сотен When Django компилирует десятки миллисекунд,
+        # поэтому CASE по ингредиенту собирается строкой с параметрами
+        items.update(total=F('total') + RawSQL(
+            'CASE ingredient_id {} END'.format(
+                ' '.join(['WHEN %s THEN %s'] * len(deltas))),
+            [value for item in deltas.items() for value in item],
+            output_field=IntegerField(),
+        ))
+        if any(delta < 0 for delta in deltas.values()):
+            items.filter(total__lte=0).delete()
+
+    @classmethod
+    def recipe_changed(cls, recipe, deltas):
+        """Переносит изменение ингредиентов рецепта в списки всех,
+        у кого он в корзине"""
+        if not any(deltas.values()):
+            return
+        cls.apply(
+            list(ShoppingCart.objects.filter(
+                recipe=recipe
+            ).values_list('user_id', flat=True)),
+            deltas
+        )
+
+
+class FeedEntry(models.Model):
+    """Лента подписок: рецепт автора, на которого подписан пользователь.
+
+    Заполняется при публикации рецепта (fan-out on write). Рецепты
+    авторов, у которых подписчиков больше FEED_FANOUT_MAX_FOLLOWERS,
+    в ленты не копируются, а добавляются при чтении. Решение хранится
+    в Recipe.fanned_out, поэтому рецепт не пропадает из лент, когда
+    число подписчиков автора переходит порог. Пересобрать —
+    rebuild_feeds.
+    """
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='feed',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_user_feed_entry',
+            )
+        ]
+
+    @staticmethod
+    def fans_out(author_id):
+        """Копировать ли новые рецепты автора в ленты подписчиков"""
+        return CustomUser.objects.filter(
+            pk=author_id,
+            followers_count__lte=settings.FEED_FANOUT_MAX_FOLLOWERS,
+        ).exists()
+
+    @classmethod
+    def fan_out(cls, recipe):
+        """Добавляет новый рецепт в ленты подписчиков автора
+        пачками по FEED_FANOUT_BATCH_SIZE"""
+        cls.objects.bulk_create(
+            (
+                cls(user_id=user_id, recipe_id=recipe.pk)
+                for user_id in Subscribe.objects.filter(
+                    following_id=recipe.author_id,
+                ).values_list('user_id', flat=True)
+            ),
+            batch_size=settings.FEED_FANOUT_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+    @classmethod
+    def follow(cls, user, author):
+        """Добавляет в ленту нового подписчика последние рецепты автора"""
+        cls.objects.bulk_create(
+            (
+                cls(user=user, recipe_id=recipe_id)
+                for recipe_id in Recipe.objects.filter(
+                    author=author,
+                    fanned_out=True,
+                ).order_by('-id').values_list(
+                    'id', flat=True
+                )[:settings.FEED_FOLLOW_BACKFILL]
+            ),
+            ignore_conflicts=True,
+        )
+
+    @classmethod
+    def recipe_ids(cls, user, limit, before=None):
+        """id рецептов страницы ленты, новые первыми: до limit штук
+        с id меньше before. Лента читается по индексу (user, recipe),
+        рецепты без fan-out — по частичному индексу (author, -id)"""
+        entries = cls.objects.filter(user=user)
+        pulled = Recipe.objects.filter(
+            author__followers__user=user,
+            fanned_out=False,
+        )
+        if before is not None:
+            entries = entries.filter(recipe_id__lt=before)
+            pulled = pulled.filter(pk__lt=before)
+        ids = set(entries.order_by('-recipe_id').values_list(
+            'recipe_id', flat=True)[:limit])
+        ids.update(pulled.order_by('-id').values_list(
+            'id', flat=True)[:limit])
+        return sorted(ids, reverse=True)[:limit]
@@ -0,0 +1,112 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from PIL import Image, ImageOps, features
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS = {
+    'thumbnail': 160,
+    'card': 480,
+    'full': 1280,
+}
+RENDITIONS_DIR = 'recipes/renditions/'
+if features.check('webp'):
+    RENDITION_FORMAT, RENDITION_EXTENSION = 'WEBP', 'webp'
+else:
+    RENDITION_FORMAT, RENDITION_EXTENSION = 'JPEG', 'jpg'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def rendition_name(image_name, rendition):
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return f'{RENDITIONS_DIR}{stem}_{rendition}.{RENDITION_EXTENSION}'
+
+
+def rendition_urls(image_name, ready):
+    """URL уменьшенных копий; пока копии не готовы (флаг
+    Recipe.renditions_ready), отдаётся оригинал. Хранилище не
+    опрашивается"""
+    if not ready:
+        original = default_storage.url(image_name)
+        return {rendition: original for rendition in RENDITIONS}
+    return {
+        rendition: default_storage.url(rendition_name(image_name, rendition))
+        for rendition in RENDITIONS
+    }
+
+
+def make_renditions(image_name):
+    """Делает недостающие копии и отмечает готовыми рецепты
+    с этим изображением"""
+    missing = {
+        rendition: size for rendition, size in RENDITIONS.items()
+        if not default_storage.exists(rendition_name(image_name, rendition))
+    }
+    if missing:
+        save_renditions(image_name, missing)
+    Recipe.objects.filter(
+        image=image_name, renditions_ready=False
+    ).update(renditions_ready=True)
+
+
+def save_renditions(image_name, missing):
+    with default_storage.open(image_name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        has_alpha = image.mode in ('RGBA', 'LA') or (
+            image.mode == 'P' and 'transparency' in image.info
+        )
+        if RENDITION_FORMAT == 'WEBP' and has_alpha:
+            image = image.convert('RGBA')
+        else:
+            image = image.convert('RGB')
+        for rendition, size in missing.items():
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            buffer = BytesIO()
+            resized.save(
+                buffer,
+                RENDITION_FORMAT,
+                quality=settings.IMAGE_RENDITION_QUALITY
+            )
+            default_storage.save(
+                rendition_name(image_name, rendition),
+                ContentFile(buffer.getvalue())
+            )
+
+
+def _make_renditions_logged(image_name):
+    close_old_connections()
+    try:
+        make_renditions(image_name)
+    except Exception:
+        logger.exception('Не удалось сделать копии %s', image_name)
+    finally:
+        close_old_connections()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_RENDITION_WORKERS,
+                thread_name_prefix='renditions'
+            )
+        return _executor
+
+
+def schedule_renditions(image_name):
+    """Готовит копии в фоновом потоке, не задерживая запрос"""
+    return get_executor().submit(_make_renditions_logged, image_name)
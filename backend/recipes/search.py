@@ -0,0 +1,150 @@
+import re
+
+from django.conf import settings
+from django.db import connections, models
+from django.db.models import BooleanField, FloatField, Value
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'recipes_recipe_fts'
+MAX_TERMS = 10
+# Веса полей: название важнее ингредиентов, ингредиенты важнее описания
+FTS_WEIGHTS = '10.0, 1.0, 5.0'
+
+PG_CREATE_INDEX_SQL = (
+    'CREATE INDEX IF NOT EXISTS recipe_search_idx '
+    'ON recipes_recipe USING gin (search_vector)'
+)
+PG_DROP_INDEX_SQL = 'DROP INDEX IF EXISTS recipe_search_idx'
+PG_INDEX_SQL = '''
+    UPDATE recipes_recipe AS recipe SET search_vector =
+        setweight(to_tsvector(%s::regconfig, recipe.name), 'A')
+        || setweight(to_tsvector(%s::regconfig, coalesce((
+            SELECT string_agg(ingredient.name, ' ')
+            FROM recipes_ingredientrecipe AS link
+            JOIN recipes_ingredient AS ingredient
+                ON ingredient.id = link.ingredient_id
+            WHERE link.recipe_id = recipe.id
+        ), '')), 'B')
+        || setweight(to_tsvector(%s::regconfig, recipe.text), 'C')
+    WHERE recipe.id BETWEEN %s AND %s
+'''
+SQLITE_CREATE_SQL = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+    "USING fts5(name, text, ingredients, tokenize='unicode61')"
+)
+SQLITE_DROP_SQL = f'DROP TABLE IF EXISTS {FTS_TABLE}'
+SQLITE_DELETE_SQL = f'DELETE FROM {FTS_TABLE} WHERE rowid BETWEEN %s AND %s'
+SQLITE_INDEX_SQL = f'''
+    INSERT INTO {FTS_TABLE} (rowid, name, text, ingredients)
+    SELECT recipe.id, recipe.name, recipe.text, coalesce((
+        SELECT group_concat(ingredient.name, ' ')
+        FROM recipes_ingredientrecipe AS link
+        JOIN recipes_ingredient AS ingredient
+            ON ingredient.id = link.ingredient_id
+        WHERE link.recipe_id = recipe.id
+    ), '')
+    FROM recipes_recipe AS recipe
+    WHERE recipe.id BETWEEN %s AND %s
+'''
+
+
+class TSVectorField(models.Field):
+    """Колонка tsvector для полнотекстового поиска в PostgreSQL.
+
+    Заполняется только index_recipes(); в других СУБД не используется.
+    """
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'tsvector'
+        return 'text'
+
+
+def create_search_index(connection):
+    """Индекс поиска для СУБД соединения: GIN или таблица FTS5"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(PG_CREATE_INDEX_SQL)
+        elif connection.vendor == 'sqlite':
+            cursor.execute(SQLITE_CREATE_SQL)
+
+
+def drop_search_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(PG_DROP_INDEX_SQL)
+        elif connection.vendor == 'sqlite':
+            cursor.execute(SQLITE_DROP_SQL)
+
+
+def index_recipes(first_id, last_id=None, using='default'):
+    """Пересчитывает поисковые данные рецептов с id от first_id
+    до last_id включительно"""
+    connection = connections[using]
+    bounds = [first_id, first_id if last_id is None else last_id]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            config = settings.SEARCH_CONFIG
+            cursor.execute(PG_INDEX_SQL, [config] * 3 + bounds)
+        elif connection.vendor == 'sqlite':
+            cursor.execute(SQLITE_DELETE_SQL, bounds)
+            cursor.execute(SQLITE_INDEX_SQL, bounds)
+
+
+def unindex_recipe(recipe_id, using='default'):
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(SQLITE_DELETE_SQL, [recipe_id, recipe_id])
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def is_ranked(queryset):
+    """Есть ли в queryset оценка релевантности от search_recipes()"""
+    return ('search_rank' in queryset.query.annotations
+            or 'search_rank' in queryset.query.extra)
+
+
+def search_recipes(queryset, query):
+    """Рецепты, где есть все слова запроса (по префиксу), с оценкой
+    релевантности search_rank; сортировка — по ней"""
+    terms = search_terms(query)
+    if not terms:
+        return queryset
+    vendor = connections[queryset.db].vendor
+    table = queryset.model._meta.db_table
+    if vendor == 'postgresql':
+        config = settings.SEARCH_CONFIG
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        queryset = queryset.annotate(
+            search_match=RawSQL(
+                f'{table}.search_vector @@ to_tsquery(%s::regconfig, %s)',
+                [config, tsquery], output_field=BooleanField()
+            ),
+            search_rank=RawSQL(
+                f'ts_rank({table}.search_vector, '
+                'to_tsquery(%s::regconfig, %s))',
+                [config, tsquery], output_field=FloatField()
+            ),
+        ).filter(search_match=True)
+    elif vendor == 'sqlite':
+        # bm25() доступна только в запросе с MATCH, поэтому таблица FTS5
+        # присоединяется через extra(): коррелированный подзапрос
+        # повторял бы MATCH для каждой найденной строки
+        match = ' '.join(f'"{term}"*' for term in terms)
+        queryset = queryset.extra(
+            select={'search_rank': f'-bm25({FTS_TABLE}, {FTS_WEIGHTS})'},
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = {table}.id',
+                   f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+        )
+    else:
+        for term in terms:
+            queryset = queryset.filter(name__icontains=term)
+        queryset = queryset.annotate(
+            search_rank=Value(0.0, output_field=FloatField()))
+    return queryset.order_by('-search_rank', '-id')
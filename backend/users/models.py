@@ -26,6 +26,16 @@ class CustomUser(AbstractUser):
         verbose_name='Фамилия'
     )
     is_subscribed = models.BooleanField(default=False)
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Рецептов',
+        default=0,
+        editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков',
+        default=0,
+        editable=False
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = [